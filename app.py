@@ -1,60 +1,110 @@
-from flask import Flask, request
+from quart import Quart, request, jsonify, abort
 import os
-import threading
-from bot import run_bot
+import asyncio
+import logging
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+from telegram import Update
+from bot import FreeFireTopUpBot, build_application, start_webhook, start_polling, stop_application
+from metrics import REGISTRY, QUEUE, BROWSER_POOL, MEMORY
 
-app = Flask(__name__)
+app = Quart(__name__)
+logger = logging.getLogger(__name__)
 
-# Run the bot in a separate thread
-def start_bot():
-    run_bot()
+# Public base URL of this service; when set, Telegram pushes updates to /webhook
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
 
-@app.route('/')
-def home():
-    return "Free Fire Top-Up Bot is running!"
+# The bot shares this server's event loop
+bot_instance = FreeFireTopUpBot()
+application = build_application(bot_instance) if bot_instance.telegram_token else None
 
-@app.route('/health')
-def health():
-    return "OK"
 
-if __name__ == '__main__':
-    # Start bot in background thread
-    bot_thread = threading.Thread(target=start_bot)
-    bot_thread.daemon = True
-    bot_thread.start()
-    
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False) flask import Flask, request, jsonify
-import asyncio
-import threading
-from bot import telegram_bot
-import os
+@app.before_serving
+async def start_bot():
+    """Start the bot in webhook mode, or fall back to polling"""
+    if application is None:
+        logger.error("TELEGRAM_BOT_TOKEN environment variable is not set!")
+        return
+    if WEBHOOK_URL:
+        await start_webhook(application, f"{WEBHOOK_URL.rstrip('/')}/webhook", WEBHOOK_SECRET)
+    else:
+        logger.info("WEBHOOK_URL not set, falling back to polling")
+        await start_polling(application)
+
 
-app = Flask(__name__)
+@app.after_serving
+async def stop_bot():
+    if application is not None:
+        await stop_application(application)
 
-# Initialize Telegram bot in a separate thread
-def start_bot():
-    asyncio.run(telegram_bot())
 
 @app.route('/')
-def home():
-    return "Free Fire Top-Up Bot is Running!"
+async def home():
+    return "Free Fire Top-Up Bot is running!"
+
 
 @app.route('/webhook', methods=['POST'])
-def webhook():
-    """Webhook endpoint for Telegram"""
-    update = request.get_json()
-    # Process Telegram updates here
+async def webhook():
+    """Webhook endpoint for Telegram: hand the update to the bot's update queue"""
+    if application is None or not WEBHOOK_URL:
+        abort(404)
+    if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        abort(403)
+
+    update = Update.de_json(await request.get_json(force=True), application.bot)
+    await application.update_queue.put(update)
     return jsonify({"status": "success"})
 
+
 @app.route('/health')
-def health_check():
-    return jsonify({"status": "healthy", "service": "freefire-topup-bot"})
+async def health():
+    """Healthy only while the bot, the order workers and the browser pool are all alive"""
+    checks = {'bot': application is not None and application.running}
+    if application is not None and not WEBHOOK_URL:
+        checks['bot'] = checks['bot'] and application.updater.running
+    checks.update(bot_instance.health())
+
+    healthy = all(checks.values())
+    return jsonify({
+        "status": "healthy" if healthy else "unhealthy",
+        "service": "freefire-topup-bot",
+        "checks": checks,
+        "queue": bot_instance.order_queue.stats(),
+        "browser_pool": bot_instance.browser_pool.stats(),
+        "session_snapshot": bot_instance.session_snapshot.stats(),
+        "prepared_pages": bot_instance.prepared_pages.stats(),
+        "uid_sessions": bot_instance.uid_sessions.stats(),
+        "http_engine": bot_instance.http_engine.stats(),
+        "player_lookup": bot_instance.player_lookup.stats(),
+        "fleet": bot_instance.shared_queue.stats() if bot_instance.shared_queue is not None else None
+    }), 200 if healthy else 503
+
+
+@app.route('/metrics')
+async def metrics():
+    """Prometheus scrape endpoint: step latencies, selector fallbacks, timeouts, outcomes and memory"""
+    queue = bot_instance.order_queue.stats()
+    QUEUE.set(queue['waiting'], state='waiting')
+    QUEUE.set(queue['running'], state='running')
+    if bot_instance.shared_queue is not None:
+        fleet = bot_instance.shared_queue.stats()
+        QUEUE.set(fleet['queued'], state='fleet_queued')
+        QUEUE.set(fleet['running'], state='fleet_running')
+        QUEUE.set(fleet['workers'], state='fleet_workers')
+    pool = bot_instance.browser_pool.stats()
+    BROWSER_POOL.set(pool['size'], kind='browsers')
+    BROWSER_POOL.set(pool['active_contexts'], kind='active_contexts')
+    sample = bot_instance.browser_pool.memory.latest
+    if sample is not None:
+        MEMORY.set(sample.bot, process='bot')
+        MEMORY.set(sample.children, process='chromium')
+        MEMORY.set(max(sample.browsers.values(), default=0), process='largest_browser')
+        MEMORY.set(bot_instance.browser_pool.memory_budget, process='budget')
+    return REGISTRY.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 
 if __name__ == '__main__':
-    # Start bot in background thread
-    bot_thread = threading.Thread(target=start_bot, daemon=True)
-    bot_thread.start()
-    
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    config = Config()
+    config.bind = [f"0.0.0.0:{int(os.environ.get('PORT', 5000))}"]
+    asyncio.run(serve(app, config))
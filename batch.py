@@ -0,0 +1,111 @@
+import re
+import time
+import asyncio
+import logging
+from typing import Dict, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BatchLine(NamedTuple):
+    """One voucher of a batch, with its line number for error messages"""
+    line: int
+    uid: str
+    amount: str
+    serial: str
+    pin: str
+
+
+def parse_batch(text: str) -> Tuple[List[BatchLine], List[str]]:
+    """
+    Split a pasted block or CSV file into `uid,amount,serial,pin` lines.
+
+    Fields may be separated by commas, semicolons, tabs or spaces; blank
+    lines, '#' comments and a header row are skipped. Returns the parsed
+    lines and an error for every malformed one.
+    """
+    lines, errors = [], []
+    for number, raw in enumerate(text.splitlines(), 1):
+        raw = raw.strip()
+        if not raw or raw.startswith('#'):
+            continue
+        fields = [field for field in re.split(r'[,;\s]+', raw) if field]
+        if fields[0].lower() == 'uid':
+            continue
+        if len(fields) != 4:
+            errors.append(f"Line {number}: expected uid,amount,serial,pin")
+            continue
+        uid, amount, serial, pin = fields
+        lines.append(BatchLine(number, uid, amount, serial.upper(), pin))
+    return lines, errors
+
+
+def _first_line(result: str) -> str:
+    """Plain first line of a Markdown result message"""
+    for line in result.strip().splitlines():
+        line = line.replace('*', '').replace('`', '').strip()
+        if line:
+            return line
+    return ''
+
+
+class BatchProgress:
+    """
+    Keeps one Telegram message updated with a batch's running totals.
+
+    Edits are serialized and throttled to one per `min_interval` seconds so a
+    large batch does not hit Telegram's edit rate limit; the final summary is
+    always sent.
+    """
+
+    def __init__(self, message, total: int, players: int, min_interval: float = 2.0):
+        self.message = message
+        self.total = total
+        self.players = players
+        self.min_interval = min_interval
+        self.results: Dict[str, Tuple[bool, str]] = {}
+        self._lock = asyncio.Lock()
+        self._last_edit = 0.0
+        self._last_text = None
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for success, _ in self.results.values() if success)
+
+    @property
+    def failed(self) -> int:
+        return len(self.results) - self.succeeded
+
+    async def record(self, serial: str, result: str):
+        self.results[serial] = (result.lstrip().startswith('✅'), _first_line(result))
+        await self.refresh()
+
+    def text(self, final: bool = False) -> str:
+        pending = self.total - len(self.results)
+        header = "📦 *Batch finished*" if final else "📦 *Batch in progress...*"
+        text = (
+            f"{header}\n\n"
+            f"🎫 *Vouchers:* {self.total} for {self.players} player(s)\n"
+            f"✅ *Succeeded:* {self.succeeded}\n"
+            f"❌ *Failed:* {self.failed}\n"
+            f"⏳ *Pending:* {pending}"
+        )
+        failures = [f"• `{serial}`: `{reason}`" for serial, (success, reason) in self.results.items() if not success]
+        if final and failures:
+            text += "\n\n*Failed vouchers:*\n" + "\n".join(failures)
+        # Telegram caps messages at 4096 characters
+        return text[:4000]
+
+    async def refresh(self, final: bool = False):
+        async with self._lock:
+            if not final and time.monotonic() - self._last_edit < self.min_interval:
+                return
+            text = self.text(final)
+            if text == self._last_text:
+                return
+            try:
+                await self.message.edit_text(text, parse_mode='Markdown')
+            except Exception as e:
+                logger.warning(f"Batch progress update failed: {e}")
+            self._last_edit = time.monotonic()
+            self._last_text = text
@@ -0,0 +1,172 @@
+"""
+End-to-end benchmark of the top-up flow against the local mock shop.
+
+Drives FreeFireTopUpBot.process_top_up and FreeFireTopUp.perform_topup
+through mock_shop.MockShop (or the bot's direct HTTP fast path with
+--engine http) and reports p50/p95 latency per step, orders per
+minute at the given concurrency and the peak RSS of the process tree
+(Python plus the Playwright driver and Chromium). Use --json to save a
+baseline to compare later runs against.
+
+    python benchmark.py --orders 20 --concurrency 4 --latency 50 --api-latency 300
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Callable, Dict, List
+from mock_shop import MockShop
+from page_actions import StepTimer
+from process_memory import RssSampler
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for no values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+async def run_engine(name: str, run_order: Callable, orders: List[Dict], concurrency: int) -> Dict:
+    """Run every order through one engine, at most `concurrency` at a time"""
+    timers: List[StepTimer] = []
+    StepTimer.observers.append(timers.append)
+    semaphore = asyncio.Semaphore(concurrency)
+    outcomes: List[bool] = []
+
+    async def one(order):
+        async with semaphore:
+            outcomes.append(await run_order(order))
+
+    try:
+        with RssSampler() as sampler:
+            started = time.perf_counter()
+            await asyncio.gather(*(one(order) for order in orders))
+            wall = time.perf_counter() - started
+    finally:
+        StepTimer.observers.remove(timers.append)
+
+    steps: Dict[str, List[float]] = {}
+    for timer in timers:
+        for step, elapsed in timer.timings:
+            steps.setdefault(step, []).append(elapsed)
+    totals = [timer.total for timer in timers]
+
+    return {
+        'engine': name,
+        'orders': len(orders),
+        'concurrency': concurrency,
+        'succeeded': sum(outcomes),
+        'wall_seconds': wall,
+        'orders_per_minute': len(orders) / wall * 60 if wall else 0.0,
+        'peak_rss_mb': sampler.peak / (1024 * 1024),
+        'total': {'p50': percentile(totals, 50), 'p95': percentile(totals, 95)},
+        'steps': {
+            step: {'p50': percentile(values, 50), 'p95': percentile(values, 95), 'count': len(values)}
+            for step, values in steps.items()
+        }
+    }
+
+
+def print_report(result: Dict):
+    print(f"\n== {result['engine']}: {result['succeeded']}/{result['orders']} succeeded "
+          f"at concurrency {result['concurrency']} ==")
+    print(f"{'step':<18}{'p50 (s)':>10}{'p95 (s)':>10}{'n':>6}")
+    for step, stats in result['steps'].items():
+        print(f"{step:<18}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['count']:>6}")
+    print(f"{'total':<18}{result['total']['p50']:>10.2f}{result['total']['p95']:>10.2f}")
+    print(f"throughput: {result['orders_per_minute']:.1f} orders/min, "
+          f"wall {result['wall_seconds']:.1f}s, peak RSS {result['peak_rss_mb']:.0f} MB")
+
+
+def make_orders(count: int, amount: str, prefix: str) -> List[Dict]:
+    """Orders with unique serials so the mock shop never reports them consumed"""
+    return [
+        {'uid': '123456789', 'amount': amount, 'serial': f"{prefix}{index:010d}", 'pin': '1234-5678-9012-3456'}
+        for index in range(count)
+    ]
+
+
+async def benchmark(args) -> List[Dict]:
+    shop = MockShop(latency_ms=args.latency, api_latency_ms=args.api_latency,
+                    failure_rate=args.fail_rate, seed=args.seed).start()
+    # Engines read the shop URL when constructed; keep benchmark state off disk
+    os.environ['GARENA_SHOP_URL'] = shop.url
+    os.environ.setdefault('SELECTOR_STATS_DB', ':memory:')
+
+    from bot import FreeFireTopUpBot
+    from topup_automation import FreeFireTopUp
+
+    results = []
+    try:
+        if args.engine in ('bot', 'both'):
+            bot = FreeFireTopUpBot()
+
+            async def run_bot_order(order):
+                result = await bot.process_top_up(order['uid'], order['amount'], order['serial'], order['pin'])
+                return result.lstrip().startswith('✅')
+
+            results.append(await run_engine(
+                'process_top_up', run_bot_order, make_orders(args.orders, args.amount, 'BDMB'), args.concurrency
+            ))
+            await bot.browser_pool.stop()
+
+        if args.engine == 'http':
+            bot = FreeFireTopUpBot()
+
+            async def run_http_order(order):
+                result = await bot.process_top_up(
+                    order['uid'], order['amount'], order['serial'], order['pin'], engine='http'
+                )
+                return result.lstrip().startswith('✅')
+
+            results.append(await run_engine(
+                'process_top_up[http]', run_http_order, make_orders(args.orders, args.amount, 'BDMB'), args.concurrency
+            ))
+            await bot.http_engine.stop()
+            await bot.browser_pool.stop()
+
+        if args.engine in ('automation', 'both'):
+            automation = FreeFireTopUp()
+
+            async def run_automation_order(order):
+                result = await automation.perform_topup(order['uid'], order['amount'], order['serial'], order['pin'])
+                return result['success']
+
+            results.append(await run_engine(
+                'perform_topup', run_automation_order, make_orders(args.orders, args.amount, 'UPBD'), args.concurrency
+            ))
+            await automation.browser_pool.stop()
+    finally:
+        shop.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the top-up flow against the mock shop")
+    parser.add_argument('--engine', choices=['bot', 'automation', 'http', 'both'], default='both')
+    parser.add_argument('--orders', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--amount', default='115')
+    parser.add_argument('--latency', type=float, default=50, help="mock page latency in ms")
+    parser.add_argument('--api-latency', type=float, default=300, help="mock API latency in ms")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="mock payment failure probability")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    results = asyncio.run(benchmark(args))
+    for result in results:
+        print_report(result)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,72 @@
 import os
+import time
+import asyncio
 import logging
+import functools
+from contextlib import asynccontextmanager
+from typing import Optional
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler
-from playwright.sync_api import sync_playwright
-import time
+from browser_pool import BrowserPool
+from page_actions import StepTimer, SelectorRacer
+from flow_engine import FlowEngine, FlowError, FlowLoader
+from denomination_catalog import DenominationCatalog
+from http_engine import HttpEngine
+from player_lookup import PlayerLookup
+from order_validation import validate_inputs
+from metrics import STEP_RETRIES, HTTP_FALLBACKS
+from selector_stats import SelectorScoreboard
+from resource_blocking import RequestBlocker
+from session_snapshot import SessionSnapshot
+from prepared_pages import PreparedPages, PreparedPage
+from uid_sessions import UidSessions
+from batch import parse_batch, BatchProgress
+from order_queue import OrderQueue, Order, QueueFull, RateLimited
+from shared_queue import SharedQueue
+from order_journal import OrderJournal, BROWSER_STARTED, CONFIRMING, CONFIRMED, QUEUED, RESULT, UNKNOWN
 
 # Conversation states
 UID, AMOUNT, SERIAL, PIN = range(4)
 
+
+# Result for an order whose worker died after clicking CONFIRM
+INTERRUPTED_AFTER_CONFIRM = (
+    "⚠️ *Your top-up was interrupted after the voucher was submitted.*\n"
+    "We are checking whether it went through. Please do not submit this voucher again."
+)
+
+
+def flow_error_text(error: FlowError) -> str:
+    """Telegram message for a flow step that could not be completed"""
+    if error.detail:
+        return f"❌ *{error.message}:* `{error.detail}`"
+    return f"❌ *{error.message}*"
+
+
+# Start of the message for a payment the shop itself declined, so the voucher was not spent
+REJECTED_TEXT = "❌ *Transaction failed:*"
+
+
+def result_outcome(result: Optional[str]) -> str:
+    """Outcome label of a result message: success, failed, or error when there is none"""
+    if result is None:
+        return 'error'
+    return 'success' if result.lstrip().startswith('✅') else 'failed'
+
+
+def result_fields(result: Optional[str]) -> dict:
+    """Journal fields of an order's RESULT record"""
+    return {
+        'outcome': result_outcome(result),
+        # A definite rejection lets the voucher be submitted again, e.g. after a mistyped PIN
+        'rejected': result is not None and result.lstrip().startswith(REJECTED_TEXT)
+    }
+
+
 class FreeFireTopUpBot:
-    def __init__(self):
+    def __init__(self, dispatch: str = None):
         self.telegram_token = os.environ.get('TELEGRAM_BOT_TOKEN')
-        self.base_url = "https://shop.garena.my"
+        self.base_url = os.environ.get('GARENA_SHOP_URL', "https://shop.garena.my").rstrip('/')
         
         # Configure logging
         logging.basicConfig(
@@ -20,17 +75,78 @@ class FreeFireTopUpBot:
         )
         self.logger = logging.getLogger(__name__)
         
-        # Diamond amount mapping
-        self.diamond_packages = {
-            '25': '25 Diamond',
-            '50': '50 Diamond', 
-            '115': '115 Diamond',
-            '240': '240 Diamond',
-            '500': '500 Diamond',
-            '610': '610 Diamond',
-            '1240': '1240 Diamond',
-            '2530': '2530 Diamond'
+        # Warm Chromium pool shared by all orders
+        self.browser_pool = BrowserPool()
+        
+        # Aborts images, fonts, media and trackers the flow never looks at
+        self.request_blocker = RequestBlocker()
+        
+        # Bounded queue limiting how many orders drive a browser at once, fair across users
+        self.order_queue = OrderQueue(self.run_order, vip_ids={
+            int(vip_id) for vip_id in os.environ.get('VIP_IDS', '').split(',') if vip_id.strip().isdigit()
+        })
+        
+        # Durable record of every order's progress, replayed on startup
+        self.order_journal = OrderJournal()
+        
+        # 'local' runs orders in this process; 'fleet' hands them to worker.py processes via the shared queue
+        dispatch = dispatch or os.environ.get('ORDER_DISPATCH', 'local')
+        self.shared_queue = SharedQueue() if dispatch == 'fleet' else None
+        self.fleet_poll_interval = float(os.environ.get('FLEET_POLL_INTERVAL', 0.5))
+        # Shared queue id -> result future of the orders this process dispatched
+        self.remote_orders = {}
+        self._result_poller = None
+        self.application = None
+        
+        # Warmed storage state at the login screen, skipping landing page and game selection
+        self.session_snapshot = SessionSnapshot()
+        
+        # Pages logged in as the player while the rest of /tp is still being typed
+        self.prepared_pages = PreparedPages(self.prepare_page)
+        
+        # Logged-in pages kept briefly for back-to-back orders on the same UID
+        self.uid_sessions = UidSessions(usable=self.browser_pool.usable)
+        
+        # Over the memory budget, idle cached and speculative contexts go before real orders are refused
+        self.browser_pool.shedders += [self.uid_sessions.shed, self.prepared_pages.shed]
+        
+        # Races each step's candidate selectors, ranked by production hit history
+        self.selector_scoreboard = SelectorScoreboard()
+        self.selector_racer = SelectorRacer(self.selector_scoreboard)
+        
+        # The declarative flow in flow.json, reloaded when the file changes
+        self.flow_loader = FlowLoader()
+        
+        # Replays the shop's backend calls without a browser; 'http' orders fall back to the browser on failure
+        self.http_engine = HttpEngine(self.base_url, self.flow_loader)
+        
+        # Live denomination list with each package's exact tile, refreshed in the background
+        self.denomination_catalog = DenominationCatalog(self.base_url, self.flow_loader, http_engine=self.http_engine)
+        self.http_engine.catalog = self.denomination_catalog
+        
+        # Executes the flow on a page
+        self.flow_engine = FlowEngine(self.base_url, self.selector_racer, self.session_snapshot, self.flow_loader,
+                                      self.denomination_catalog)
+        self.default_engine = os.environ.get('TOPUP_ENGINE', 'browser')
+        
+        # Cached UID -> nickname lookups, so typos are caught before any browser work
+        self.player_lookup = PlayerLookup(self.http_engine)
+        
+        # Telegram user IDs allowed to run admin commands
+        self.admin_ids = {
+            int(admin_id) for admin_id in os.environ.get('ADMIN_IDS', '').split(',') if admin_id.strip().isdigit()
         }
+        
+        # Telegram user IDs allowed to run /batch (admins always are)
+        self.reseller_ids = {
+            int(reseller_id) for reseller_id in os.environ.get('RESELLER_IDS', '').split(',')
+            if reseller_id.strip().isdigit()
+        }
+
+    @property
+    def diamond_packages(self) -> dict:
+        """Diamond amount mapping: the packages on sale now, or the flow definition's when the catalog is stale"""
+        return self.denomination_catalog.amounts()
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Send welcome message when command /start is issued."""
@@ -59,6 +175,14 @@ PIN: `1234-5678-9012-3456`
 
     async def topup_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start the top-up conversation."""
+        self.prepared_pages.release(update.effective_user.id)
+        
+        # Don't let the user type out an order the queue would refuse
+        retry_after = self.order_queue.retry_after(update.effective_user.id)
+        if retry_after:
+            await update.message.reply_text(self.rate_limited_text(retry_after), parse_mode='Markdown')
+            return ConversationHandler.END
+        
         await update.message.reply_text(
             "🚀 *Starting Top-Up Process* 🚀\n\n"
             "Please enter your *Free Fire UID*:",
@@ -71,20 +195,39 @@ PIN: `1234-5678-9012-3456`
         uid = update.message.text.strip()
         
         # Validate UID
-        if not uid.isdigit() or len(uid) < 6:
+        if not self.valid_uid(uid):
             await update.message.reply_text(
                 "❌ *Invalid UID!* Please enter a valid numeric UID (at least 6 digits):",
                 parse_mode='Markdown'
             )
             return UID
         
+        # Ask the shop who this is; None means it could not be reached, so carry on unchecked
+        player = await self.player_lookup.resolve(uid)
+        if player is not None and not player.valid:
+            await update.message.reply_text(
+                f"❌ *No Free Fire player found with UID* `{uid}`. Please check it and enter it again:",
+                parse_mode='Markdown'
+            )
+            return UID
+        
         context.user_data['uid'] = uid
         
+        # Start logging in as this player while the user types the rest
+        if self.default_engine == 'browser' and self.shared_queue is None:
+            self.prepared_pages.start(update.effective_user.id, uid)
+        
+        player_text = ""
+        if player is not None:
+            nickname = player.nickname.replace('`', "'")
+            player_text = f"👤 *Player:* `{nickname}`\nNot you? Use /cancel and start again.\n\n"
+        
         # Show available amounts
         amounts_text = "\n".join([f"• {amount} diamonds" for amount in self.diamond_packages.keys()])
         await update.message.reply_text(
-            f"✅ *UID Accepted:* `{uid}`\n\n"
-            f"*Please enter diamond amount:*\n{amounts_text}\n\n"
+            f"✅ *UID Accepted:* `{uid}`\n"
+            f"{player_text}"
+            f"\n*Please enter diamond amount:*\n{amounts_text}\n\n"
             f"*Example:* `500`",
             parse_mode='Markdown'
         )
@@ -117,7 +260,7 @@ PIN: `1234-5678-9012-3456`
         serial = update.message.text.strip().upper()
         
         # Validate serial format
-        if not (serial.startswith('BDMB') or serial.startswith('UPBD')):
+        if not self.valid_serial(serial):
             await update.message.reply_text(
                 "❌ *Invalid Serial!* Must start with *BDMB* or *UPBD*\n"
                 "Please enter correct serial code:",
@@ -125,6 +268,15 @@ PIN: `1234-5678-9012-3456`
             )
             return SERIAL
         
+        # Never submit the same voucher twice
+        if not self.order_journal.can_submit(serial):
+            await update.message.reply_text(
+                "❌ *This serial has already been submitted.*\n"
+                "Please enter a different serial code:",
+                parse_mode='Markdown'
+            )
+            return SERIAL
+        
         context.user_data['serial'] = serial
         
         await update.message.reply_text(
@@ -141,8 +293,7 @@ PIN: `1234-5678-9012-3456`
         pin = update.message.text.strip()
         
         # Validate PIN format
-        pin_clean = pin.replace('-', '')
-        if not pin_clean.isdigit() or len(pin_clean) != 16:
+        if not self.valid_pin(pin):
             await update.message.reply_text(
                 "❌ *Invalid PIN format!* Must be 16 digits\n"
                 "Please enter PIN in format: `XXXX-XXXX-XXXX-XXXX`",
@@ -151,21 +302,74 @@ PIN: `1234-5678-9012-3456`
             return PIN
         
         context.user_data['pin'] = pin
+        serial = context.user_data['serial']
         
-        # Send processing message
-        processing_msg = await update.message.reply_text(
-            "🔄 *Processing your top-up request...*\n"
-            "This may take 1-2 minutes. Please wait...",
-            parse_mode='Markdown'
-        )
+        # Another conversation may have submitted this serial meanwhile; claim it before any await
+        if not self.order_journal.reserve(serial):
+            await update.message.reply_text(
+                "❌ *This serial has already been submitted.*\nUse /tp to start again.",
+                parse_mode='Markdown'
+            )
+            self.prepared_pages.release(update.effective_user.id)
+            context.user_data.clear()
+            return ConversationHandler.END
         
-        # Process top-up (this runs in a separate thread to avoid blocking)
-        result = await self.run_top_up_sync(
-            context.user_data['uid'],
-            context.user_data['amount'],
-            context.user_data['serial'],
-            context.user_data['pin']
-        )
+        try:
+            # Send status message; the queue keeps it updated with our position
+            processing_msg = await update.message.reply_text(
+                "⏳ *Queuing your top-up request...*",
+                parse_mode='Markdown'
+            )
+        
+            async def show_position(ahead):
+                await processing_msg.edit_text(self.queue_status_text(ahead), parse_mode='Markdown')
+        
+            order = Order(
+                context.user_data['uid'],
+                context.user_data['amount'],
+                context.user_data['serial'],
+                context.user_data['pin'],
+                user_id=update.effective_user.id,
+                on_position=show_position
+            )
+        
+            try:
+                self.order_queue.submit(order)
+            except RateLimited as e:
+                self.logger.info(f"Rate limited user {order.user_id}: {e}")
+                await processing_msg.edit_text(self.rate_limited_text(e.retry_after), parse_mode='Markdown')
+                self.prepared_pages.release(update.effective_user.id)
+                context.user_data.clear()
+                return ConversationHandler.END
+            except QueueFull:
+                self.logger.warning(f"Order queue full, refusing order: {self.order_queue.stats()}")
+                await processing_msg.edit_text(
+                    "🚦 *We're handling too many top-ups right now.*\n"
+                    "Your voucher has *not* been used. Please try /tp again in a few minutes.",
+                    parse_mode='Markdown'
+                )
+                self.prepared_pages.release(update.effective_user.id)
+                context.user_data.clear()
+                return ConversationHandler.END
+        
+            self.order_journal.record(
+                serial, QUEUED,
+                uid=order.uid,
+                amount=order.amount,
+                user_id=order.user_id,
+                chat_id=update.effective_chat.id
+            )
+        finally:
+            # Journalled as QUEUED (or refused) by now
+            self.order_journal.release(serial)
+        
+        # Wait for a browser worker to run the order
+        try:
+            result = await order.result
+        except Exception as e:
+            result = f"❌ *Top-up process failed:* `{str(e)}`"
+        
+        self.logger.info(f"Browser pool stats: {self.browser_pool.stats()}, queue: {self.order_queue.stats()}")
         
         # Send result
         await processing_msg.edit_text(result, parse_mode='Markdown')
@@ -175,428 +379,552 @@ PIN: `1234-5678-9012-3456`
         
         return ConversationHandler.END
 
-    async def run_top_up_sync(self, uid: str, amount: str, serial: str, pin: str) -> str:
-        """Run the sync top-up function in executor to avoid blocking"""
-        import asyncio
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, self.process_top_up, uid, amount, serial, pin)
+    @staticmethod
+    def valid_uid(uid: str) -> bool:
+        return uid.isdigit() and len(uid) >= 6
+
+    @staticmethod
+    def valid_serial(serial: str) -> bool:
+        return serial.startswith('BDMB') or serial.startswith('UPBD')
+
+    @staticmethod
+    def valid_pin(pin: str) -> bool:
+        pin_clean = pin.replace('-', '')
+        return pin_clean.isdigit() and len(pin_clean) == 16
+
+    async def batch_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Reseller command: top up many vouchers from a pasted block or an uploaded CSV."""
+        user_id = update.effective_user.id
+        if user_id not in self.reseller_ids and user_id not in self.admin_ids:
+            await update.message.reply_text("❌ *This command is for resellers only.*", parse_mode='Markdown')
+            return
+        
+        retry_after = self.order_queue.retry_after(user_id)
+        if retry_after:
+            await update.message.reply_text(self.rate_limited_text(retry_after), parse_mode='Markdown')
+            return
+        
+        document = update.message.document
+        if document:
+            if document.file_size and document.file_size > 1024 * 1024:
+                await update.message.reply_text("❌ *CSV file is too large* (max 1 MB).", parse_mode='Markdown')
+                return
+            file = await document.get_file()
+            text = (await file.download_as_bytearray()).decode('utf-8-sig', errors='replace')
+        else:
+            # Everything after the /batch command itself
+            parts = update.message.text.split(maxsplit=1)
+            text = parts[1] if len(parts) > 1 else ''
+        
+        lines, errors = parse_batch(text)
+        if not lines and not errors:
+            await update.message.reply_text(
+                "📦 *Batch top-up*\n\n"
+                "Send `/batch` followed by one voucher per line, or upload a `.csv` file:\n"
+                "`uid,amount,serial,pin`\n\n"
+                "*Example:*\n"
+                "`/batch`\n"
+                "`1234567890,115,BDMB1S00001234,1234-5678-9012-3456`\n"
+                "`1234567890,240,UPBD1S00005678,1234-5678-9012-3456`",
+                parse_mode='Markdown'
+            )
+            return
+        
+        errors += await self.validate_batch(lines)
+        if errors:
+            await update.message.reply_text(
+                f"❌ *Batch rejected, nothing was submitted.* Please fix:\n" + "\n".join(errors[:30]),
+                parse_mode='Markdown'
+            )
+            return
+        
+        # Validation awaited, so claim every serial again, this time with no await in between
+        reserved = [line.serial for line in lines if self.order_journal.reserve(line.serial)]
+        if len(reserved) < len(lines):
+            for serial in reserved:
+                self.order_journal.release(serial)
+            taken = [line.serial for line in lines if line.serial not in reserved]
+            await update.message.reply_text(
+                f"❌ *Batch rejected, nothing was submitted.* Already submitted:\n"
+                + "\n".join(f"`{serial}`" for serial in taken[:30]),
+                parse_mode='Markdown'
+            )
+            return
+        
+        try:
+            # Vouchers for the same player run one after another on one logged-in page
+            groups = {}
+            for line in lines:
+                groups.setdefault(line.uid, []).append(line)
+        
+            progress_msg = await update.message.reply_text("📦 *Queuing your batch...*", parse_mode='Markdown')
+            progress = BatchProgress(progress_msg, len(lines), len(groups))
+        
+            orders = []
+            for uid, group in groups.items():
+                order = Order(
+                    uid, group[0].amount, group[0].serial, group[0].pin,
+                    user_id=user_id,
+                    handler=functools.partial(self.run_batch_group, group, progress),
+                    batch=True
+                )
+                try:
+                    # A batch counts once against the reseller's rate limit
+                    self.order_queue.submit(order, rate_limit=not orders)
+                except QueueFull:
+                    for line in group:
+                        await progress.record(line.serial, "🚦 Not submitted, the queue is full. Voucher not used.")
+                    continue
+                for line in group:
+                    self.order_journal.record(
+                        line.serial, QUEUED,
+                        uid=uid,
+                        amount=line.amount,
+                        user_id=user_id,
+                        chat_id=update.effective_chat.id
+                    )
+                orders.append(order)
+        finally:
+            # Journalled as QUEUED (or refused) by now
+            for serial in reserved:
+                self.order_journal.release(serial)
+        
+        await progress.refresh()
+        await asyncio.gather(*(order.result for order in orders), return_exceptions=True)
+        self.logger.info(f"Batch of {len(lines)} finished: {progress.succeeded} succeeded, {progress.failed} failed")
+        await progress.refresh(final=True)
+
+    async def validate_batch(self, lines: list) -> list:
+        """Check every batch line with the /tp rules; returns one error per bad line"""
+        errors = []
+        seen = set()
+        uids = list({line.uid for line in lines if self.valid_uid(line.uid)})
+        players = dict(zip(uids, await asyncio.gather(*(self.player_lookup.resolve(uid) for uid in uids))))
+        for line in lines:
+            problems = []
+            if not self.valid_uid(line.uid):
+                problems.append("invalid UID")
+            elif players[line.uid] is not None and not players[line.uid].valid:
+                problems.append("no player with this UID")
+            if line.amount not in self.diamond_packages:
+                problems.append("invalid amount")
+            if not self.valid_serial(line.serial):
+                problems.append("serial must start with BDMB or UPBD")
+            elif line.serial in seen or not self.order_journal.can_submit(line.serial):
+                problems.append("serial already submitted")
+            if not self.valid_pin(line.pin):
+                problems.append("PIN must be 16 digits")
+            if not problems:
+                valid, message = await validate_inputs(
+                    self.denomination_catalog, line.uid, line.amount, line.serial, line.pin
+                )
+                if not valid:
+                    problems.append(message)
+            seen.add(line.serial)
+            if problems:
+                errors.append(f"Line {line.line}: {', '.join(problems)}")
+        return errors
+
+    async def run_batch_group(self, lines: list, progress: BatchProgress, order: Order) -> str:
+        """Order queue handler for a batch: one UID's vouchers, one after another on its logged-in page"""
+        for line in lines:
+            self.order_journal.record(line.serial, BROWSER_STARTED)
+            # Each voucher picks up the page the previous one left in the UID session cache
+            result = await self.execute(order.uid, line.amount, line.serial, line.pin)
+            self.order_journal.record(line.serial, RESULT, durable=True, **result_fields(result))
+            await progress.record(line.serial, result)
+        return f"{len(lines)} vouchers for {order.uid}"
+
+    def queue_status_text(self, ahead) -> str:
+        """Status message for an order that is queued or has started"""
+        if ahead is None:
+            return (
+                "🔄 *Processing your top-up request...*\n"
+                "This may take 1-2 minutes. Please wait..."
+            )
+        if ahead == 0:
+            return "⏳ *You're next in line.* Your top-up will start shortly..."
+        return f"⏳ *You're #{ahead + 1} in the queue.* Your top-up will start automatically..."
+
+    @staticmethod
+    def rate_limited_text(retry_after: float) -> str:
+        """Message for a user who is submitting orders too quickly"""
+        return (
+            "🚦 *You're sending top-ups too quickly.*\n"
+            f"Your voucher has *not* been used. Please try again in {max(int(retry_after), 1)} seconds."
+        )
+
+    async def run_order(self, order: Order) -> str:
+        """Order queue handler: run one queued order on a browser"""
+        self.order_journal.record(order.serial, BROWSER_STARTED)
+        result = await self.execute(
+            order.uid, order.amount, order.serial, order.pin, user_id=order.user_id, engine=order.engine
+        )
+        self.order_journal.record(order.serial, RESULT, durable=True, **result_fields(result))
         return result
 
-    def process_top_up(self, uid: str, amount: str, serial: str, pin: str) -> str:
+    async def execute(self, uid: str, amount: str, serial: str, pin: str, user_id: int = None,
+                      engine: str = None) -> str:
+        """Run an order here, or on the worker fleet in fleet mode"""
+        if self.shared_queue is None:
+            return await self.process_top_up(uid, amount, serial, pin, user_id=user_id, engine=engine)
+        
+        record = self.order_journal.orders.get(serial, {})
+        order_id = await asyncio.to_thread(
+            self.shared_queue.enqueue, serial, uid, amount, pin, record.get('user_id', user_id),
+            record.get('chat_id'), engine
+        )
+        future = asyncio.get_running_loop().create_future()
+        self.remote_orders[order_id] = future
+        try:
+            return await future
+        finally:
+            self.remote_orders.pop(order_id, None)
+
+    async def _poll_remote_results(self):
+        """Resolve dispatched orders as workers finish them, and reassign dead workers' orders"""
+        last_reap = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_reap >= self.shared_queue.dead_after / 3:
+                    last_reap = time.monotonic()
+                    await asyncio.to_thread(self.shared_queue.reap, INTERRUPTED_AFTER_CONFIRM)
+                delivered = []
+                for row in await asyncio.to_thread(self.shared_queue.finished):
+                    if row['past_confirm']:
+                        self.order_journal.record(row['serial'], CONFIRMED, durable=True)
+                    future = self.remote_orders.get(row['id'])
+                    if future is not None and not future.done():
+                        future.set_result(row['result'])
+                    else:
+                        # Dispatched before a restart of this process; nobody is waiting for it
+                        await self.deliver_orphan(row)
+                    delivered.append(row['id'])
+                if delivered:
+                    await asyncio.to_thread(self.shared_queue.mark_delivered, delivered)
+            except Exception as e:
+                self.logger.error(f"Polling the worker fleet failed: {e}")
+            await asyncio.sleep(self.fleet_poll_interval)
+
+    async def deliver_orphan(self, row: dict):
+        """Send the result of an order dispatched by a previous run of the front end"""
+        self.order_journal.record(row['serial'], RESULT, durable=True, **result_fields(row['result']))
+        if self.application is None or not row['chat_id']:
+            return
+        try:
+            await self.application.bot.send_message(row['chat_id'], row['result'], parse_mode='Markdown')
+        except Exception as e:
+            self.logger.warning(f"Could not deliver the result for {row['serial']} to chat {row['chat_id']}: {e}")
+
+    async def process_top_up(self, uid: str, amount: str, serial: str, pin: str, user_id: int = None,
+                             engine: str = None) -> str:
         """
-        Main function to process Free Fire top-up using Playwright
+        Main function to process Free Fire top-up.
+
+        `engine` is 'browser' (async Playwright) or 'http' (the direct HTTP
+        fast path, falling back to the browser); defaults to TOPUP_ENGINE.
         """
+        engine = engine or self.default_engine
+        timer = StepTimer(f"order {serial}", engine='http' if engine == 'http' else 'bot',
+                          amount=amount, voucher=serial[:4])
+        result = None
+        prepared = None
         try:
-            with sync_playwright() as p:
-                # Launch browser in headless mode
-                browser = p.chromium.launch(
-                    headless=True,
-                    args=['--no-sandbox', '--disable-dev-shm-usage', '--disable-blink-features=AutomationControlled']
-                )
-                
-                context = browser.new_context(
-                    viewport={'width': 1920, 'height': 1080},
-                    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                )
-                
-                page = context.new_page()
+            if engine == 'http':
+                result = await self._http_top_up(uid, amount, serial, pin, timer)
+            if result is None:
+                prepared = await self.prepared_pages.claim(user_id, uid) if user_id is not None else None
+                result = await self._run_top_up(uid, amount, serial, pin, timer, prepared)
+            return result
+        finally:
+            if prepared is not None:
+                self.prepared_pages.done(prepared)
+            elif user_id is not None:
+                self.prepared_pages.release(user_id)
+            timer.finish(result_outcome(result))
+            self.selector_scoreboard.flush()
+
+    async def _http_top_up(self, uid: str, amount: str, serial: str, pin: str, timer: StepTimer) -> Optional[str]:
+        """Run the order on the HTTP fast path; None means fall back to the browser"""
+        try:
+            transaction = await self.http_engine.top_up(
+                uid, amount, serial, pin, timer, not_sent=self.not_sent_hook(serial), **self.confirm_hooks(serial)
+            )
+        except FlowError as e:
+            if e.confirmed:
+                return flow_error_text(e)
+            self.logger.warning(f"HTTP fast path failed at {e.step} ({e}), falling back to the browser")
+            HTTP_FALLBACKS.inc(step=e.step)
+            timer.mark('http_fallback')
+            timer.labels['engine'] = 'bot'
+            return None
+        return self.transaction_text(uid, amount, serial, transaction)
+
+    async def _run_top_up(self, uid: str, amount: str, serial: str, pin: str, timer: StepTimer,
+                          prepared: PreparedPage = None) -> str:
+        """Walk the shop flow, resuming on a new page if the browser dies before CONFIRM"""
+        try:
+            resumes = self.flow_engine.flow.before_confirm.resumes
+            for resume in range(resumes + 1):
+                try:
+                    return await self._attempt_top_up(uid, amount, serial, pin, timer, prepared)
+                except FlowError as e:
+                    if not e.resumable or resume >= resumes:
+                        return flow_error_text(e)
+                    self.logger.warning(f"Page lost at step {e.step}, resuming order {serial} on a new page")
+                    STEP_RETRIES.inc(step=e.step, budget='resume')
+                    prepared = None
+
+        except Exception as e:
+            self.logger.error(f"Top-up process failed: {e}")
+            return f"❌ *Top-up process failed:* `{str(e)}`"
+
+    async def _attempt_top_up(self, uid: str, amount: str, serial: str, pin: str, timer: StepTimer,
+                              prepared: PreparedPage = None) -> str:
+        """One pass over the shop flow, advancing as soon as each step's page is ready"""
+        # A page prepared while the user was typing is already at the payment screen
+        if prepared is not None:
+            self.logger.info(f"Using the page prepared for UID {uid}")
+            return await self._pay(prepared.page, uid, amount, serial, pin, timer)
+        
+        # Reuse this player's logged-in page from a recent order if there is one
+        session = await self.uid_sessions.take(uid)
+        if session is not None:
+            self.logger.info(f"Reusing the logged-in page for UID {uid}")
+            try:
+                await session.page.goto(session.payment_url, timeout=60000)
+                timer.mark('return_to_payment')
+            except Exception as e:
+                self.logger.warning(f"Cached session for UID {uid} is unusable: {e}")
+                await session.close()
+                session = None
+        
+        if session is None:
+            # Lease a fresh isolated context from the warm browser pool
+            session = await self.uid_sessions.open(uid, self.browser_pool.context(**self.context_options()))
+            try:
+                await self.request_blocker.attach(session.context, f"session {uid}")
+                session.page = await session.context.new_page()
                 
                 self.logger.info("Starting top-up process...")
                 
-                # Step 1: Navigate to Garena Shop
-                try:
-                    page.goto(f"{self.base_url}/?channel=202953", timeout=60000)
-                    page.wait_for_load_state('networkidle')
-                    self.logger.info("Loaded Garena shop")
-                except Exception as e:
-                    return f"❌ *Failed to load Garena shop:* `{str(e)}`"
+                # Steps 1-4: Reach the payment screen logged in as the player; a warm snapshot deep-links there
+                await self._prepare_payment(session.context, session.page, uid, timer)
+            except BaseException:
+                await session.close()
+                raise
+            session.payment_url = session.page.url
+        
+        # Steps 5-8: Pay with the voucher, then keep the page for a follow-up order
+        try:
+            result = await self._pay(session.page, uid, amount, serial, pin, timer)
+        except BaseException:
+            await session.close()
+            raise
+        await self.uid_sessions.keep(session)
+        return result
 
-                # Step 2: Select Free Fire game
-                try:
-                    # Try multiple selectors for Free Fire game
-                    selectors = [
-                        "img[alt*='Free Fire']",
-                        "img[alt*='FREE FIRE']", 
-                        "img[src*='free-fire']",
-                        "div[class*='free-fire']",
-                        "//img[contains(@alt, 'Free Fire')]",
-                        "//div[contains(text(), 'Free Fire')]"
-                    ]
-                    
-                    free_fire_found = False
-                    for selector in selectors:
-                        try:
-                            if selector.startswith('//'):
-                                element = page.wait_for_selector(f"xpath={selector}", timeout=5000)
-                            else:
-                                element = page.wait_for_selector(selector, timeout=5000)
-                            element.click()
-                            free_fire_found = True
-                            self.logger.info("Selected Free Fire game")
-                            break
-                        except:
-                            continue
-                    
-                    if not free_fire_found:
-                        return "❌ *Could not find Free Fire game selection*"
-                    
-                    time.sleep(3)
-                except Exception as e:
-                    return f"❌ *Failed to select Free Fire game:* `{str(e)}`"
+    def context_options(self) -> dict:
+        """Browser context options for an order, starting from the warmed session snapshot when there is one"""
+        return {
+            'viewport': {'width': 1920, 'height': 1080},
+            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            **self.session_snapshot.context_options()
+        }
 
-                # Step 3: Login with Player ID
-                try:
-                    # Try multiple selectors for UID input
-                    uid_selectors = [
-                        "input[placeholder*='player ID']",
-                        "input[placeholder*='Player ID']",
-                        "input[type='text']",
-                        "input[name*='id']",
-                        "//input[contains(@placeholder, 'player')]"
-                    ]
-                    
-                    uid_input_found = False
-                    for selector in uid_selectors:
-                        try:
-                            if selector.startswith('//'):
-                                element = page.wait_for_selector(f"xpath={selector}", timeout=5000)
-                            else:
-                                element = page.wait_for_selector(selector, timeout=5000)
-                            element.fill(uid)
-                            uid_input_found = True
-                            break
-                        except:
-                            continue
-                    
-                    if not uid_input_found:
-                        return "❌ *Could not find UID input field*"
-                    
-                    # Find and click login button
-                    login_selectors = [
-                        "button:has-text('Login')",
-                        "button[type='submit']",
-                        "//button[contains(text(), 'Login')]"
-                    ]
-                    
-                    login_found = False
-                    for selector in login_selectors:
-                        try:
-                            if selector.startswith('//'):
-                                element = page.wait_for_selector(f"xpath={selector}", timeout=5000)
-                            else:
-                                element = page.wait_for_selector(selector, timeout=5000)
-                            element.click()
-                            login_found = True
-                            break
-                        except:
-                            continue
-                    
-                    if not login_found:
-                        return "❌ *Could not find login button*"
-                    
-                    self.logger.info(f"Logged in with UID: {uid}")
-                    time.sleep(3)
-                except Exception as e:
-                    return f"❌ *Failed to login with UID:* `{str(e)}`"
+    async def _prepare_payment(self, context, page, uid: str, timer: StepTimer):
+        """Steps 1-4 on a fresh page; raises FlowError on failure"""
+        await self.flow_engine.open_login_screen(context, page, timer)
+        self.logger.info("Reached the Free Fire login screen")
+        await self.flow_engine.log_in(page, uid, timer)
+        self.logger.info(f"Logged in with UID: {uid}")
 
-                # Step 4: Select UniPin payment method
-                try:
-                    unipin_selectors = [
-                        "div:has-text('UniPin Credits & Voucher')",
-                        "//div[contains(text(), 'UniPin')]",
-                        "div[class*='unipin']"
-                    ]
-                    
-                    unipin_found = False
-                    for selector in unipin_selectors:
-                        try:
-                            if selector.startswith('//'):
-                                element = page.wait_for_selector(f"xpath={selector}", timeout=5000)
-                            else:
-                                element = page.wait_for_selector(selector, timeout=5000)
-                            element.click()
-                            unipin_found = True
-                            break
-                        except:
-                            continue
-                    
-                    if not unipin_found:
-                        return "❌ *Could not find UniPin payment option*"
-                    
-                    # Click proceed to payment
-                    proceed_selectors = [
-                        "button:has-text('Proceed to Payment')",
-                        "//button[contains(text(), 'Proceed')]"
-                    ]
-                    
-                    proceed_found = False
-                    for selector in proceed_selectors:
-                        try:
-                            if selector.startswith('//'):
-                                element = page.wait_for_selector(f"xpath={selector}", timeout=5000)
-                            else:
-                                element = page.wait_for_selector(selector, timeout=5000)
-                            element.click()
-                            proceed_found = True
-                            break
-                        except:
-                            continue
-                    
-                    if not proceed_found:
-                        return "❌ *Could not find proceed button*"
-                    
-                    self.logger.info("Selected UniPin payment method")
-                    time.sleep(3)
-                except Exception as e:
-                    return f"❌ *Failed to select UniPin payment:* `{str(e)}`"
+    @asynccontextmanager
+    async def prepare_page(self, uid: str):
+        """Lease a context and drive it to the payment screen for `uid`; yields None on failure"""
+        timer = StepTimer(f"prepare {uid}", engine='prepare', amount='-', voucher='-')
+        async with self.browser_pool.context(**self.context_options()) as context:
+            await self.request_blocker.attach(context, f"prepared page {uid}")
+            page = await context.new_page()
+            try:
+                await self._prepare_payment(context, page, uid, timer)
+                error = None
+            except Exception as e:
+                error = str(e)
+            timer.finish('failed' if error else 'success')
+            if error:
+                self.logger.warning(f"Could not prepare a page for UID {uid}: {error}")
+            yield None if error else page
 
-                # Step 5: Select diamond amount
-                try:
-                    diamond_amount = self.diamond_packages.get(amount)
-                    if not diamond_amount:
-                        return f"❌ *Invalid amount:* `{amount}`"
-                    
-                    diamond_selectors = [
-                        f"button:has-text('{diamond_amount}')",
-                        f"//button[contains(text(), '{diamond_amount}')]",
-                        f"div:has-text('{diamond_amount}')"
-                    ]
-                    
-                    diamond_found = False
-                    for selector in diamond_selectors:
-                        try:
-                            if selector.startswith('//'):
-                                element = page.wait_for_selector(f"xpath={selector}", timeout=5000)
-                            else:
-                                element = page.wait_for_selector(selector, timeout=5000)
-                            element.click()
-                            diamond_found = True
-                            break
-                        except:
-                            continue
-                    
-                    if not diamond_found:
-                        return f"❌ *Could not find diamond amount:* `{diamond_amount}`"
-                    
-                    self.logger.info(f"Selected diamond amount: {diamond_amount}")
-                    time.sleep(3)
-                except Exception as e:
-                    return f"❌ *Failed to select diamond amount {amount}:* `{str(e)}`"
+    async def _pay(self, page, uid: str, amount: str, serial: str, pin: str, timer: StepTimer) -> str:
+        """Steps 5-8 on a page at the payment screen: amount, voucher, confirm and result"""
+        transaction = await self.flow_engine.pay(page, amount, serial, pin, timer, **self.confirm_hooks(serial))
+        return self.transaction_text(uid, amount, serial, transaction)
 
-                # Step 6: Select voucher type based on serial prefix
-                try:
-                    page.wait_for_selector("text=Select Payment Channel", timeout=15000)
-                    
-                    # Click Physical Vouchers dropdown
-                    physical_selectors = [
-                        "div:has-text('Physical Vouchers')",
-                        "//div[contains(text(), 'Physical Vouchers')]"
-                    ]
-                    
-                    for selector in physical_selectors:
-                        try:
-                            if selector.startswith('//'):
-                                element = page.wait_for_selector(f"xpath={selector}", timeout=5000)
-                            else:
-                                element = page.wait_for_selector(selector, timeout=5000)
-                            element.click()
-                            break
-                        except:
-                            continue
-                    
-                    time.sleep(2)
-                    
-                    # Select voucher type based on serial prefix
-                    if serial.startswith('BDMB'):
-                        voucher_selectors = [
-                            "div:has-text('UniPin')",
-                            "//div[contains(text(), 'UniPin')]"
-                        ]
-                    elif serial.startswith('UPBD'):
-                        voucher_selectors = [
-                            "div:has-text('UP Gift Card')", 
-                            "//div[contains(text(), 'UP Gift Card')]"
-                        ]
-                    else:
-                        return "❌ *Invalid serial code format.* Must start with BDMB or UPBD"
-                    
-                    voucher_found = False
-                    for selector in voucher_selectors:
-                        try:
-                            if selector.startswith('//'):
-                                element = page.wait_for_selector(f"xpath={selector}", timeout=5000)
-                            else:
-                                element = page.wait_for_selector(selector, timeout=5000)
-                            element.click()
-                            voucher_found = True
-                            break
-                        except:
-                            continue
-                    
-                    if not voucher_found:
-                        return "❌ *Could not find voucher type*"
-                    
-                    self.logger.info(f"Selected voucher type for serial: {serial}")
-                    time.sleep(3)
-                except Exception as e:
-                    return f"❌ *Failed to select voucher type:* `{str(e)}`"
+    def confirm_hooks(self, serial: str) -> dict:
+        """Journal callbacks run right around the CONFIRM submission"""
+        return {
+            # From here on the voucher may be consumed; make that durable first
+            'before_confirm': lambda: self.order_journal.record(serial, CONFIRMING, durable=True),
+            'after_confirm': lambda: self.order_journal.record(serial, CONFIRMED, durable=True)
+        }
 
-                # Step 7: Enter voucher details
-                try:
-                    # Wait for voucher input form and fill serial
-                    serial_selectors = [
-                        "input[placeholder*='Serial']",
-                        "input[placeholder*='serial']",
-                        "input[name*='serial']"
-                    ]
-                    
-                    serial_found = False
-                    for selector in serial_selectors:
-                        try:
-                            if selector.startswith('//'):
-                                element = page.wait_for_selector(f"xpath={selector}", timeout=5000)
-                            else:
-                                element = page.wait_for_selector(selector, timeout=5000)
-                            element.fill(serial)
-                            serial_found = True
-                            break
-                        except:
-                            continue
-                    
-                    if not serial_found:
-                        return "❌ *Could not find serial input field*"
-                    
-                    # Fill PIN (remove dashes)
-                    pin_clean = pin.replace('-', '')
-                    pin_selectors = [
-                        "input[placeholder*='PIN']",
-                        "input[placeholder*='pin']", 
-                        "input[name*='pin']",
-                        "input[type='password']"
-                    ]
-                    
-                    pin_found = False
-                    for selector in pin_selectors:
-                        try:
-                            if selector.startswith('//'):
-                                element = page.wait_for_selector(f"xpath={selector}", timeout=5000)
-                            else:
-                                element = page.wait_for_selector(selector, timeout=5000)
-                            element.fill(pin_clean)
-                            pin_found = True
-                            break
-                        except:
-                            continue
-                    
-                    if not pin_found:
-                        return "❌ *Could not find PIN input field*"
-                    
-                    # Click confirm button
-                    confirm_selectors = [
-                        "button:has-text('CONFIRM')",
-                        "//button[contains(text(), 'CONFIRM')]",
-                        "button[type='submit']"
-                    ]
-                    
-                    confirm_found = False
-                    for selector in confirm_selectors:
-                        try:
-                            if selector.startswith('//'):
-                                element = page.wait_for_selector(f"xpath={selector}", timeout=5000)
-                            else:
-                                element = page.wait_for_selector(selector, timeout=5000)
-                            element.click()
-                            confirm_found = True
-                            break
-                        except:
-                            continue
-                    
-                    if not confirm_found:
-                        return "❌ *Could not find confirm button*"
-                    
-                    self.logger.info("Submitted voucher details")
-                    time.sleep(5)
-                except Exception as e:
-                    return f"❌ *Failed to submit voucher details:* `{str(e)}`"
+    def not_sent_hook(self, serial: str):
+        """Undo the CONFIRMING record when the HTTP payment request could not even connect"""
+        # Back in flight on the browser fallback, no longer counted as past CONFIRM
+        return lambda: self.order_journal.record(serial, BROWSER_STARTED, durable=True, unsent=True)
 
-                # Step 8: Check transaction result
-                try:
-                    # Check for various success/error indicators
-                    success_indicators = [
-                        "text=Transaction successful",
-                        "text=Payment Completed",
-                        "text=successful",
-                        "text=Success"
-                    ]
-                    
-                    error_indicators = [
-                        "text=Consumed Voucher",
-                        "text=Invalid",
-                        "text=Error",
-                        "text=Failed"
-                    ]
-                    
-                    # Check for success
-                    success_found = False
-                    for indicator in success_indicators:
-                        if page.query_selector(indicator):
-                            success_found = True
-                            break
-                    
-                    # Check for errors
-                    error_found = False
-                    error_message = ""
-                    for indicator in error_indicators:
-                        element = page.query_selector(indicator)
-                        if element:
-                            error_found = True
-                            error_message = element.inner_text()
-                            break
-                    
-                    if success_found:
-                        result = f"""
+    def transaction_text(self, uid: str, amount: str, serial: str, transaction: dict) -> str:
+        """Telegram message for a transaction result from either engine"""
+        self.logger.info(f"Transaction result from {transaction['source']}: {transaction['status']}")
+        if transaction['status'] == 'success':
+            self.logger.info("Top-up successful")
+            return f"""
 ✅ *TOP-UP SUCCESSFUL!*
 
 🎮 *Game:* Free Fire
 👤 *UID:* `{uid}`
-💎 *Amount:* {diamond_amount}
+💎 *Amount:* {self.diamond_packages.get(amount, amount)}
 📦 *Serial:* `{serial}`
+🧾 *Transaction:* `{transaction['transaction_id'] or 'N/A'}`
 
 💰 *Transaction completed successfully!*
 Your diamonds should be credited to your account shortly.
-                        """
-                        self.logger.info("Top-up successful")
-                        return result
-                    
-                    elif error_found:
-                        return f"❌ *Transaction failed:* `{error_message}`"
-                    
-                    else:
-                        # Try to get any message text from the page
-                        body_text = page.inner_text("body")
-                        if "success" in body_text.lower():
-                            result = f"""
-✅ *TOP-UP LIKELY SUCCESSFUL!*
+            """
+        elif transaction['status'] == 'failed':
+            return f"{REJECTED_TEXT} `{transaction['message']}`"
+        else:
+            return "❌ *Transaction status unclear.* Please try again or contact support."
 
-🎮 *Game:* Free Fire  
-👤 *UID:* `{uid}`
-💎 *Amount:* {diamond_amount}
-
-*Please check your Free Fire account to confirm diamond receipt.*
-                            """
-                            return result
-                        else:
-                            return "❌ *Transaction status unclear.* Please try again or contact support."
-                        
+    async def selectors_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin command: dump the current selector ranking per step."""
+        if update.effective_user.id not in self.admin_ids:
+            await update.message.reply_text("❌ *This command is for admins only.*", parse_mode='Markdown')
+            return
+        
+        report = self.selector_scoreboard.report()
+        # Telegram caps messages at 4096 characters
+        for start in range(0, len(report), 4000):
+            await update.message.reply_text(report[start:start + 4000])
+
+    async def vip_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin command: list, add or remove users whose orders are served first."""
+        if update.effective_user.id not in self.admin_ids:
+            await update.message.reply_text("❌ *This command is for admins only.*", parse_mode='Markdown')
+            return
+        
+        vip_ids = self.order_queue.vip_ids
+        args = context.args or []
+        if len(args) == 2 and args[0] in ('add', 'remove') and args[1].isdigit():
+            if args[0] == 'add':
+                vip_ids.add(int(args[1]))
+            else:
+                vip_ids.discard(int(args[1]))
+            self.logger.info(f"Admin {update.effective_user.id} {args[0]} VIP {args[1]}")
+        elif args:
+            await update.message.reply_text("Usage: `/vip [add|remove <user_id>]`", parse_mode='Markdown')
+            return
+        
+        listed = "\n".join(f"• `{vip_id}`" for vip_id in sorted(vip_ids)) or "None"
+        await update.message.reply_text(f"⭐ *VIP users:*\n{listed}", parse_mode='Markdown')
+
+    async def unblock_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin command: allow a blocked serial again once its voucher was checked and found unspent."""
+        if update.effective_user.id not in self.admin_ids:
+            await update.message.reply_text("❌ *This command is for admins only.*", parse_mode='Markdown')
+            return
+        
+        args = context.args or []
+        if len(args) != 1:
+            await update.message.reply_text("Usage: `/unblock <serial>`", parse_mode='Markdown')
+            return
+        
+        serial = args[0].upper()
+        if not self.order_journal.clear(serial, update.effective_user.id):
+            await update.message.reply_text(
+                f"❌ `{serial}` *is still being processed.* Try again once it has finished.",
+                parse_mode='Markdown'
+            )
+            return
+        self.logger.info(f"Admin {update.effective_user.id} unblocked serial {serial}")
+        await update.message.reply_text(f"✅ `{serial}` *can be submitted again.*", parse_mode='Markdown')
+
+    def health(self) -> dict:
+        """Liveness of the order workers and the browser pool (the fleet's result poller in fleet mode)"""
+        if self.shared_queue is not None:
+            return {
+                'queue': self.order_queue.alive,
+                'fleet': self._result_poller is not None and not self._result_poller.done()
+            }
+        return {
+            'queue': self.order_queue.alive,
+            'browser_pool': self.browser_pool.alive
+        }
+
+    async def notify_recovered_orders(self, application: Application, orders: list):
+        """Tell users (and admins) about orders a restart left unfinished"""
+        for record in orders:
+            if record['state'] == UNKNOWN:
+                text = (
+                    f"⚠️ *Your top-up for serial* `{record['serial']}` *was interrupted after the voucher was submitted.*\n"
+                    "We are checking whether it went through. Please do not submit this voucher again."
+                )
+            else:
+                text = (
+                    f"⚠️ *Your top-up for serial* `{record['serial']}` *was interrupted by a restart.*\n"
+                    "The voucher was not submitted. Please use /tp to try again."
+                )
+            if record.get('chat_id'):
+                try:
+                    await application.bot.send_message(record['chat_id'], text, parse_mode='Markdown')
                 except Exception as e:
-                    return f"❌ *Error checking transaction status:* `{str(e)}`"
+                    self.logger.warning(f"Could not notify chat {record['chat_id']}: {e}")
+        
+        unknown = [record['serial'] for record in orders if record['state'] == UNKNOWN]
+        if not unknown:
+            return
+        for admin_id in self.admin_ids:
+            try:
+                await application.bot.send_message(
+                    admin_id,
+                    "⚠️ Orders interrupted after CONFIRM, check these vouchers:\n" + "\n".join(unknown)
+                    + "\n\nUse /unblock <serial> for any voucher that was not spent."
+                )
+            except Exception as e:
+                self.logger.warning(f"Could not notify admin {admin_id}: {e}")
 
-                finally:
-                    browser.close()
-                    
-        except Exception as e:
-            self.logger.error(f"Top-up process failed: {e}")
-            return f"❌ *Top-up process failed:* `{str(e)}`"
+    async def post_init(self, application: Application):
+        """Recover the order journal, warm up the browser pool and start the order workers"""
+        self.application = application
+        await self.order_journal.start()
+        if self.shared_queue is not None:
+            # Orders already handed to the fleet keep running; their results are delivered when they finish
+            still_running = await asyncio.to_thread(self.shared_queue.active_serials)
+            await self.notify_recovered_orders(application, self.order_journal.recover(still_running))
+            self._result_poller = asyncio.create_task(self._poll_remote_results())
+            # No browsers here, but the front end's own RSS is still worth watching
+            await self.browser_pool.memory.start()
+        else:
+            await self.notify_recovered_orders(application, self.order_journal.recover())
+            await self.browser_pool.start()
+        await self.uid_sessions.start()
+        await self.denomination_catalog.start()
+        await self.order_queue.start()
+
+    async def post_shutdown(self, application: Application):
+        """Stop the order workers, close pooled browsers and save selector stats on shutdown"""
+        await self.order_queue.stop()
+        if self._result_poller is not None:
+            self._result_poller.cancel()
+            await asyncio.gather(self._result_poller, return_exceptions=True)
+            self._result_poller = None
+        await self.prepared_pages.stop()
+        await self.uid_sessions.stop()
+        await self.browser_pool.stop()
+        await self.denomination_catalog.stop()
+        await self.http_engine.stop()
+        self.selector_scoreboard.flush()
+        await self.order_journal.stop()
 
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Cancel the conversation."""
@@ -604,40 +932,110 @@ Your diamonds should be credited to your account shortly.
             "❌ *Top-up cancelled.*\nUse /tp to start again.",
             parse_mode='Markdown'
         )
+        self.prepared_pages.release(update.effective_user.id)
         context.user_data.clear()
         return ConversationHandler.END
 
 
-def run_bot():
-    """Run the telegram bot with polling"""
-    bot_instance = FreeFireTopUpBot()
+def build_application(bot_instance: FreeFireTopUpBot) -> Application:
+    """Create the telegram Application with all handlers registered"""
+    builder = (
+        Application.builder()
+        .token(bot_instance.telegram_token)
+        .post_init(bot_instance.post_init)
+        .post_shutdown(bot_instance.post_shutdown)
+    )
     
-    if not bot_instance.telegram_token:
-        bot_instance.logger.error("TELEGRAM_BOT_TOKEN environment variable is not set!")
-        return
+    # Point the bot at another Bot API server (e.g. a local fake one for tests)
+    api_base_url = os.environ.get('TELEGRAM_API_BASE_URL')
+    if api_base_url:
+        builder = builder.base_url(api_base_url)
     
-    # Create application
-    application = Application.builder().token(bot_instance.telegram_token).build()
+    application = builder.build()
     
-    # Add conversation handler
+    # Updates are processed one by one, as ConversationHandler requires; the handlers
+    # that wait on the shop (player lookup, whole orders) run with block=False so they never hold up other users
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('tp', bot_instance.topup_command)],
         states={
-            UID: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot_instance.get_uid)],
+            UID: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot_instance.get_uid, block=False)],
             AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot_instance.get_amount)],
             SERIAL: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot_instance.get_serial)],
-            PIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot_instance.get_pin)],
+            PIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot_instance.get_pin, block=False)],
         },
         fallbacks=[CommandHandler('cancel', bot_instance.cancel)]
     )
     
     application.add_handler(CommandHandler("start", bot_instance.start))
+    application.add_handler(CommandHandler("selectors", bot_instance.selectors_command))
+    application.add_handler(CommandHandler("unblock", bot_instance.unblock_command))
+    application.add_handler(CommandHandler("vip", bot_instance.vip_command))
+    application.add_handler(CommandHandler("batch", bot_instance.batch_command, block=False))
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension('csv') | filters.Document.MimeType('text/csv'),
+        bot_instance.batch_command,
+        block=False
+    ))
     application.add_handler(conv_handler)
     
+    return application
+
+
+async def start_webhook(application: Application, webhook_url: str, secret_token: str = None):
+    """
+    Start the application in webhook mode without a server of its own.
+    
+    Telegram is told to POST updates to `webhook_url`; the web entry point
+    feeds them into application.update_queue.
+    """
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    await application.bot.set_webhook(
+        url=webhook_url,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=True,
+        secret_token=secret_token
+    )
+    logging.getLogger(__name__).info(f"Webhook set to {webhook_url}")
+
+
+async def start_polling(application: Application):
+    """Start the application and poll for updates on the running event loop"""
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    await application.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    logging.getLogger(__name__).info("Started bot polling")
+
+
+async def stop_application(application: Application):
+    """Stop an application started with start_webhook or start_polling"""
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    await application.shutdown()
+
+
+def run_bot():
+    """Run the telegram bot with polling (fallback when no webhook is configured)"""
+    bot_instance = FreeFireTopUpBot()
+    
+    if not bot_instance.telegram_token:
+        bot_instance.logger.error("TELEGRAM_BOT_TOKEN environment variable is not set!")
+        return
+    
+    application = build_application(bot_instance)
+    
     # Start polling
     bot_instance.logger.info("Starting bot polling...")
     application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
 
 
 if __name__ == '__main__':
-    run_bot()
\ No newline at end of file
+    run_bot()
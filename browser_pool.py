@@ -0,0 +1,301 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+from playwright.async_api import async_playwright, Browser
+from metrics import MEMORY_ACTIONS
+from process_memory import MB, MemoryMonitor, MemorySample, browser_pids
+
+# Launch flags shared by every pooled browser
+DEFAULT_LAUNCH_ARGS = [
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-blink-features=AutomationControlled',
+    '--disable-features=VizDisplayCompositor',
+    '--disable-background-timer-throttling',
+    '--disable-backgrounding-occluded-windows',
+    '--disable-renderer-backgrounding'
+]
+
+# Extra flags per BROWSER_PROFILE, on top of DEFAULT_LAUNCH_ARGS
+LAUNCH_PROFILES = {
+    'standard': [
+        '--disable-gpu',
+        '--disable-extensions'
+    ],
+    # Small instances such as Render's free plan: fewer renderers, a capped JS heap, no background work
+    'lowmem': [
+        '--disable-gpu',
+        '--disable-extensions',
+        '--disable-software-rasterizer',
+        '--renderer-process-limit=2',
+        '--js-flags=--max-old-space-size=128',
+        '--disable-background-networking',
+        '--disable-component-update'
+    ]
+}
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    """No memory left under the pool's budget for another browser context"""
+
+    def __init__(self, used: int, budget: int):
+        super().__init__(f"The server is low on memory ({used // MB} of {budget // MB} MB), please try again shortly")
+        self.used = used
+        self.budget = budget
+
+
+class PooledBrowser:
+    """A pooled Chromium plus its lease bookkeeping"""
+
+    def __init__(self, browser: Browser, pid: int = None):
+        self.browser = browser
+        # Chromium's browser process, when it could be found under /proc
+        self.pid = pid
+        self.uses = 0
+        self.active = 0
+        self.retiring = False
+
+    @property
+    def healthy(self) -> bool:
+        return self.browser.is_connected() and not self.retiring
+
+
+class BrowserPool:
+    """
+    Long-lived pool of warm headless Chromium browsers.
+
+    Browsers are started once on the bot's event loop and hand out a fresh,
+    isolated BrowserContext per order. A browser is retired after max_uses
+    leases or as soon as it crashes, and a new one is launched on demand.
+
+    Memory is watched through a MemoryMonitor. While the bot's process tree
+    is over `memory_budget_mb` (BROWSER_MEMORY_BUDGET_MB), the `shedders`
+    drop optional contexts (cached and speculative pages), idle browsers
+    are closed and new contexts wait up to `memory_wait` seconds
+    (BROWSER_MEMORY_WAIT) before they are refused with
+    MemoryBudgetExceeded. A browser whose own tree grows past
+    `browser_ceiling_mb` (BROWSER_MEMORY_CEILING_MB) is retired like one
+    that reached max_uses. Either limit is off at 0. Launch flags come
+    from the `profile` (BROWSER_PROFILE) in LAUNCH_PROFILES.
+    """
+
+    def __init__(self, min_size: int = None, max_size: int = None, max_uses: int = None,
+                 contexts_per_browser: int = None, launch_args: List[str] = None, profile: str = None,
+                 memory_budget_mb: float = None, browser_ceiling_mb: float = None, memory_wait: float = None,
+                 memory: MemoryMonitor = None):
+        self.min_size = int(min_size if min_size is not None else os.environ.get('BROWSER_POOL_MIN_SIZE', 1))
+        self.max_size = int(max_size if max_size is not None else os.environ.get('BROWSER_POOL_MAX_SIZE', 2))
+        self.max_uses = int(max_uses if max_uses is not None else os.environ.get('BROWSER_MAX_USES', 50))
+        self.contexts_per_browser = int(
+            contexts_per_browser if contexts_per_browser is not None
+            else os.environ.get('BROWSER_CONTEXTS_PER_BROWSER', 4)
+        )
+        self.min_size = min(self.min_size, self.max_size)
+        self.profile = profile or os.environ.get('BROWSER_PROFILE', 'standard')
+        if self.profile not in LAUNCH_PROFILES:
+            raise ValueError(f"Unknown BROWSER_PROFILE {self.profile!r}; expected one of {', '.join(LAUNCH_PROFILES)}")
+        self.launch_args = launch_args or DEFAULT_LAUNCH_ARGS + LAUNCH_PROFILES[self.profile]
+        self.memory_budget = int(MB * float(
+            memory_budget_mb if memory_budget_mb is not None else os.environ.get('BROWSER_MEMORY_BUDGET_MB', 0)
+        ))
+        self.browser_ceiling = int(MB * float(
+            browser_ceiling_mb if browser_ceiling_mb is not None else os.environ.get('BROWSER_MEMORY_CEILING_MB', 0)
+        ))
+        self.memory_wait = float(memory_wait if memory_wait is not None else os.environ.get('BROWSER_MEMORY_WAIT', 30))
+        self.memory = memory or MemoryMonitor()
+        self.memory.observers.append(self._check_ceilings)
+        # Called over the memory budget to close optional contexts; each returns how many it closed
+        self.shedders: List[Callable[[], Awaitable[int]]] = []
+        self.logger = logging.getLogger(__name__)
+
+        self._playwright = None
+        self._browsers: List[PooledBrowser] = []
+        self._lock = asyncio.Lock()
+
+        # Pool statistics
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+        self.refused = 0
+        self.memory_recycled = 0
+
+    async def start(self):
+        """Start Playwright and the memory monitor, and pre-launch min_size browsers"""
+        await self.memory.start()
+        async with self._lock:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            while len(self._browsers) < self.min_size:
+                self._browsers.append(await self._launch())
+        self.logger.info(f"Browser pool started: {self.stats()}")
+
+    async def stop(self):
+        """Close every pooled browser and stop Playwright"""
+        await self.memory.stop()
+        async with self._lock:
+            for pooled in self._browsers:
+                await self._close(pooled)
+            self._browsers.clear()
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    async def _launch(self) -> PooledBrowser:
+        # Launches are serialised by the pool lock, so the one new browser process is this browser's
+        running = await asyncio.to_thread(browser_pids, self.memory.pid) if self.memory.enabled else set()
+        browser = await self._playwright.chromium.launch(
+            headless=True,
+            args=self.launch_args
+        )
+        pooled = PooledBrowser(browser)
+        if self.memory.enabled:
+            launched = await asyncio.to_thread(browser_pids, self.memory.pid) - running
+            if len(launched) == 1:
+                pooled.pid = launched.pop()
+                self.memory.browsers.add(pooled.pid)
+        self.logger.info(f"Launched pooled browser (profile {self.profile}, pid {pooled.pid})")
+        return pooled
+
+    async def _close(self, pooled: PooledBrowser):
+        self.memory.browsers.discard(pooled.pid)
+        try:
+            await pooled.browser.close()
+        except Exception:
+            pass
+
+    async def _check_ceilings(self, sample: MemorySample):
+        """Memory observer: retire every browser whose tree is over the per-browser ceiling"""
+        if not self.browser_ceiling:
+            return
+        async with self._lock:
+            for pooled in list(self._browsers):
+                rss = sample.browsers.get(pooled.pid, 0)
+                if rss > self.browser_ceiling:
+                    self.memory_recycled += 1
+                    MEMORY_ACTIONS.inc(action='recycled')
+                    await self._retire(pooled, f"{rss // MB} MB over the {self.browser_ceiling // MB} MB ceiling")
+
+    async def _wait_for_memory(self):
+        """Hold a new lease while the process tree is over the memory budget, refusing it after memory_wait"""
+        if not self.memory_budget:
+            return
+        sample = await self.memory.current()
+        deadline = time.monotonic() + self.memory_wait
+        while sample is not None and sample.total >= self.memory_budget:
+            for shed in self.shedders:
+                try:
+                    closed = await shed()
+                except Exception as e:
+                    self.logger.warning(f"Shedding contexts over the memory budget failed: {e}")
+                    continue
+                if closed:
+                    self.logger.info(f"Closed {closed} optional contexts, {sample.total // MB} MB in use")
+            async with self._lock:
+                for pooled in list(self._browsers):
+                    if pooled.active == 0:
+                        await self._retire(pooled, f"idle while {sample.total // MB} MB is in use")
+            if time.monotonic() >= deadline:
+                self.refused += 1
+                MEMORY_ACTIONS.inc(action='refused')
+                raise MemoryBudgetExceeded(sample.total, self.memory_budget)
+            await asyncio.sleep(1)
+            sample = await self.memory.sample()
+
+    async def _retire(self, pooled: PooledBrowser, reason: str):
+        """Drop a browser from the pool; close it once its last context is gone"""
+        pooled.retiring = True
+        if pooled in self._browsers:
+            self._browsers.remove(pooled)
+            self.recycled += 1
+            self.logger.info(f"Recycling pooled browser ({reason})")
+        if pooled.active == 0:
+            await self._close(pooled)
+
+    async def _acquire(self) -> PooledBrowser:
+        """Pick the least loaded healthy browser, launching one if needed"""
+        await self._wait_for_memory()
+        async with self._lock:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+
+            for pooled in list(self._browsers):
+                if not pooled.browser.is_connected():
+                    await self._retire(pooled, "crashed")
+
+            candidates = [b for b in self._browsers if b.healthy]
+            pooled: Optional[PooledBrowser] = min(candidates, key=lambda b: b.active, default=None)
+
+            saturated = pooled is None or pooled.active >= self.contexts_per_browser
+            if saturated and len(self._browsers) < self.max_size:
+                pooled = await self._launch()
+                self._browsers.append(pooled)
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            pooled.uses += 1
+            pooled.active += 1
+            if pooled.uses >= self.max_uses:
+                # Serve this last lease, then let the browser drain and close
+                await self._retire(pooled, f"reached {self.max_uses} uses")
+            return pooled
+
+    async def _release(self, pooled: PooledBrowser):
+        async with self._lock:
+            pooled.active -= 1
+            if not pooled.browser.is_connected():
+                await self._retire(pooled, "crashed")
+            elif pooled.retiring and pooled.active == 0:
+                await self._close(pooled)
+
+    @asynccontextmanager
+    async def context(self, **context_options):
+        """
+        Lease a fresh BrowserContext for one order.
+
+        The context is always closed on exit and the browser goes back to the
+        pool, or is recycled if it crashed during the order. Raises
+        MemoryBudgetExceeded when memory stays over the budget.
+        """
+        pooled = await self._acquire()
+        try:
+            context = await pooled.browser.new_context(**context_options)
+            try:
+                yield context
+            finally:
+                try:
+                    await context.close()
+                except Exception:
+                    pass
+        finally:
+            await self._release(pooled)
+
+    def usable(self, context) -> bool:
+        """False for a context whose browser crashed or is being recycled"""
+        return any(pooled.browser is context.browser and pooled.healthy for pooled in self._browsers)
+
+    @property
+    def alive(self) -> bool:
+        """True once started, unless every pooled browser has lost its connection"""
+        if self._playwright is None:
+            return False
+        return not self._browsers or any(b.browser.is_connected() for b in self._browsers)
+
+    def stats(self) -> Dict:
+        """Current pool size and hit/miss counters"""
+        return {
+            'size': len(self._browsers),
+            'active_contexts': sum(b.active for b in self._browsers),
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'recycled': self.recycled,
+            'profile': self.profile,
+            'memory_refused': self.refused,
+            'memory_recycled': self.memory_recycled,
+            'memory': self.memory.stats()
+        }
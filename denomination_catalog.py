@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, NamedTuple, Optional
+import httpx
+from flow_engine import FlowLoader
+
+logger = logging.getLogger(__name__)
+
+
+class Denomination(NamedTuple):
+    """One diamond package the shop currently offers"""
+    amount: str
+    label: str
+    # Exact selector of its tile on the payment page, when the shop gives it an id
+    selector: Optional[str]
+
+
+def css_string(value) -> str:
+    """`value` escaped for use inside a double-quoted CSS string, e.g. [id="..."]"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+class DenominationCatalog:
+    """
+    The shop's live denomination list, refreshed in the background.
+
+    The list is fetched from the `api.denominations` endpoint in flow.json
+    every `interval` seconds (CATALOG_REFRESH_INTERVAL), over the
+    `http_engine`'s pooled connections when given one. Tile selectors come
+    from the `catalog.selector` template with {id} (CSS-escaped), {amount}
+    and {label}. The list is served while younger than `max_age`
+    (CATALOG_MAX_AGE); when it is missing or stale, callers fall back to
+    the amounts in flow.json.
+    """
+
+    def __init__(self, base_url: str, loader: FlowLoader = None, interval: float = None, max_age: float = None,
+                 timeout: float = None, http_engine=None):
+        self.base_url = base_url.rstrip('/')
+        self.loader = loader or FlowLoader()
+        self.http_engine = http_engine
+        # Used when there is no HttpEngine to share connections with; kept across refreshes
+        self._client: Optional[httpx.AsyncClient] = None
+        self.interval = float(interval if interval is not None else os.environ.get('CATALOG_REFRESH_INTERVAL', 600))
+        self.max_age = float(max_age if max_age is not None else os.environ.get('CATALOG_MAX_AGE', 3600))
+        self.timeout = float(timeout if timeout is not None else os.environ.get('HTTP_TIMEOUT', 15))
+        self.denominations: Dict[str, Denomination] = {}
+        self.refreshed_at: Optional[float] = None
+        self.attempted_at: Optional[float] = None
+        self.refreshes = 0
+        self.errors = 0
+        self._lock = asyncio.Lock()
+        self._refresher: Optional[asyncio.Task] = None
+
+    @property
+    def fresh(self) -> bool:
+        return self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.max_age
+
+    def amounts(self) -> Dict[str, str]:
+        """Amount -> label of every package on sale, from the flow definition when the catalog is stale"""
+        if self.fresh:
+            return {amount: denomination.label for amount, denomination in self.denominations.items()}
+        return self.loader.current().amount_labels()
+
+    def get(self, amount: str) -> Optional[Denomination]:
+        return self.denominations.get(amount) if self.fresh else None
+
+    async def current(self) -> Dict[str, str]:
+        """Like amounts(), refreshing first when the catalog is stale (at most once a minute)"""
+        if not self.fresh and (self.attempted_at is None or time.monotonic() - self.attempted_at >= 60):
+            await self.refresh()
+        return self.amounts()
+
+    async def refresh(self) -> bool:
+        """Fetch the denomination list; keeps the previous one when that fails"""
+        async with self._lock:
+            self.attempted_at = time.monotonic()
+            flow = self.loader.current()
+            path = flow.api.get('denominations')
+            if not path:
+                return False
+            try:
+                response = await self.client().get(path, params={'app_id': flow.api.get('app_id')})
+                response.raise_for_status()
+                data = response.json()
+                denominations = data.get('denominations', []) if isinstance(data, dict) else data
+                template = flow.catalog.get('selector')
+                catalog = {}
+                for entry in denominations:
+                    amount, label = str(entry['amount']), str(entry.get('label') or f"{entry['amount']} Diamond")
+                    selector = None
+                    if template and entry.get('id'):
+                        selector = template.format(id=css_string(entry['id']), amount=amount, label=label)
+                    catalog[amount] = Denomination(amount, label, selector)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Refreshing the denomination catalog failed: {e!r}")
+                return False
+
+            if not catalog:
+                self.errors += 1
+                logger.warning("The shop returned no denominations; keeping the previous catalog")
+                return False
+            if set(catalog) != set(self.denominations):
+                logger.info(f"Denominations on sale: {', '.join(catalog)}")
+            self.denominations = catalog
+            self.refreshed_at = time.monotonic()
+            self.refreshes += 1
+            return True
+
+    def client(self) -> httpx.AsyncClient:
+        if self.http_engine is not None:
+            return self.http_engine.client()
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout)
+        return self._client
+
+    async def start(self):
+        """Fetch the catalog now and keep refreshing it in the background"""
+        if self.interval > 0:
+            self._refresher = asyncio.create_task(self._refresh_periodically())
+
+    async def _refresh_periodically(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict:
+        return {
+            'denominations': len(self.denominations),
+            'fresh': self.fresh,
+            'age_seconds': round(time.monotonic() - self.refreshed_at) if self.refreshed_at is not None else None,
+            'refreshes': self.refreshes,
+            'errors': self.errors
+        }
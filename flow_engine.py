@@ -0,0 +1,402 @@
+import os
+import json
+import inspect
+import time
+import asyncio
+import logging
+import weakref
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+from playwright.async_api import BrowserContext, Page
+from page_actions import wait_until_ready, url_changed_from, to_locator, StepTimer, SelectorRacer, ResultWatcher
+from session_snapshot import SessionSnapshot
+from metrics import STEP_RETRIES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLOW_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flow.json')
+PHASES = ('login_screen', 'login', 'payment')
+ACTIONS = ('goto', 'click', 'fill', 'confirm')
+
+
+async def call_hook(hook: Optional[Callable[[], Any]]):
+    """Run a confirm hook; one that returns an awaitable (e.g. a write in a thread) is awaited"""
+    if hook is None:
+        return
+    result = hook()
+    if inspect.isawaitable(result):
+        await result
+
+
+class FlowError(Exception):
+    """
+    A flow step could not be completed; `message` is meant for the user.
+
+    `page_lost` is set when the page or its browser died, so the order can
+    only carry on from a new page. `confirmed` is set once CONFIRM was
+    clicked, after which the order must never be run again.
+    """
+
+    def __init__(self, step: str, message: str, detail: str = None, page_lost: bool = False,
+                 confirmed: bool = False):
+        super().__init__(f"{message}: {detail}" if detail else message)
+        self.step = step
+        self.message = message
+        self.detail = detail
+        self.page_lost = page_lost
+        self.confirmed = confirmed
+
+    @property
+    def resumable(self) -> bool:
+        """The page died before CONFIRM, so the order may resume on a new one"""
+        return self.page_lost and not self.confirmed
+
+
+class RetryPolicy(NamedTuple):
+    """
+    How often to try again and how long to back off in between.
+
+    `attempts` counts the first try. The delay doubles from `backoff`
+    seconds up to `max_backoff`. `resumes` is how many times an order may
+    start over on a new page after its page died.
+    """
+    attempts: int = 1
+    backoff: float = 0.5
+    max_backoff: float = 4
+    resumes: int = 0
+
+    def delay(self, attempt: int) -> float:
+        return min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+
+
+class FlowDefinition:
+    """
+    The top-up flow as data, loaded from flow.json.
+
+    Each phase (login_screen, login, payment) is a list of steps. A step has
+    a `name` (also its key on the selector scoreboard), an `action` (goto,
+    click, fill or confirm), `candidates` raced by the SelectorRacer, an
+    optional `direct` selector tried alone first when its values are known
+    (e.g. a denomination's exact tile from the catalog), an optional `ready`
+    condition (selector, url_changed, timeout in ms), the
+    timer `mark` it closes, and the user-facing `error` (nothing matched)
+    and `failure` (the step raised) messages. Candidates, values and ready
+    selectors may use {uid}, {amount_label}, {voucher_label}, {serial},
+    {pin}, {base_url} and {login_screen}.
+
+    `retry` holds two RetryPolicy budgets: `before_confirm` for steps up to
+    and including finding the CONFIRM button, where trying again is safe
+    (a step may override it with its own `attempts`), and `after_confirm`
+    for reading an unclear result again. CONFIRM itself is never clicked
+    twice.
+    """
+
+    def __init__(self, data: Dict, path: str = None):
+        self.path = path
+        self.login_screen: str = data['login_screen']
+        self.amounts: Dict[str, List[str]] = data['amounts']
+        self.vouchers: Dict[str, str] = data['vouchers']
+        self.result: Dict = data.get('result', {})
+        # Shop backend endpoints replayed by the HTTP fast path; empty disables it
+        self.api: Dict = data.get('api', {})
+        # How the denomination catalog derives each package's exact selector
+        self.catalog: Dict = data.get('catalog', {})
+        retry = data.get('retry', {})
+        self.before_confirm = RetryPolicy(**retry.get('before_confirm', {}))
+        self.after_confirm = RetryPolicy(**retry.get('after_confirm', {}))
+        self.phases: Dict[str, List[Dict]] = data['phases']
+        self._validate()
+
+    def _validate(self):
+        for phase in PHASES:
+            if phase not in self.phases:
+                raise ValueError(f"flow has no '{phase}' phase")
+            for step in self.phases[phase]:
+                if step.get('action') not in ACTIONS:
+                    raise ValueError(f"step {step.get('name')!r} has unknown action {step.get('action')!r}")
+                if step['action'] != 'goto' and not step.get('candidates'):
+                    raise ValueError(f"step {step.get('name')!r} has no candidates")
+        payment = self.phases['payment']
+        if not payment or payment[-1]['action'] != 'confirm':
+            raise ValueError("the payment phase must end with a confirm step")
+        if self.before_confirm.attempts < 1 or self.after_confirm.attempts < 1:
+            raise ValueError("retry attempts must be at least 1")
+
+    @classmethod
+    def load(cls, path: str) -> 'FlowDefinition':
+        with open(path, encoding='utf-8') as flow_file:
+            return cls(json.load(flow_file), path)
+
+    def amount_labels(self) -> Dict[str, str]:
+        """Amount -> the label shown to users"""
+        return {amount: labels[0] for amount, labels in self.amounts.items()}
+
+
+class FlowLoader:
+    """
+    Serves the current flow definition, reloading it when the file changes.
+
+    The file's mtime is checked at most every `interval` seconds
+    (FLOW_RELOAD_INTERVAL). A definition that fails to parse or validate is
+    logged and the last good one stays in use, so fixing selector drift
+    never needs a restart and a typo never takes the bot down.
+    """
+
+    def __init__(self, path: str = None, interval: float = None):
+        self.path = path or os.environ.get('FLOW_PATH', DEFAULT_FLOW_PATH)
+        self.interval = float(interval if interval is not None else os.environ.get('FLOW_RELOAD_INTERVAL', 5))
+        self.flow = FlowDefinition.load(self.path)
+        self._mtime = os.path.getmtime(self.path)
+        self._checked = time.monotonic()
+        self.reloads = 0
+
+    def current(self) -> FlowDefinition:
+        now = time.monotonic()
+        if now - self._checked >= self.interval:
+            self._checked = now
+            self._reload_if_changed()
+        return self.flow
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+            self.flow = FlowDefinition.load(self.path)
+            self.reloads += 1
+            logger.info(f"Reloaded flow definition from {self.path}")
+        except Exception as e:
+            logger.error(f"Keeping the previous flow definition, {self.path} is invalid: {e}")
+
+
+class FlowEngine:
+    """
+    Executes the flow definition on a page.
+
+    Shared by the Telegram bot and FreeFireTopUp so selector racing,
+    readiness waits, session snapshots, result detection and timing are
+    implemented once. A failed step is tried again on the same page, so
+    the flow resumes from the last step that succeeded; steps raise
+    FlowError with the step's user-facing message once their retry budget
+    is spent or the page is gone.
+    """
+
+    def __init__(self, base_url: str, racer: SelectorRacer = None, session_snapshot: SessionSnapshot = None,
+                 loader: FlowLoader = None, catalog=None):
+        self.base_url = base_url.rstrip('/')
+        self.racer = racer or SelectorRacer()
+        self.session_snapshot = session_snapshot or SessionSnapshot()
+        self.loader = loader or FlowLoader()
+        # Optional DenominationCatalog with the live labels and exact tile selectors
+        self.catalog = catalog
+        # Pages that deep-linked from the session snapshot -> when that snapshot was captured
+        self._snapshot_pages: 'weakref.WeakKeyDictionary[Page, float]' = weakref.WeakKeyDictionary()
+
+    @property
+    def flow(self) -> FlowDefinition:
+        return self.loader.current()
+
+    def _values(self, flow: FlowDefinition, **values) -> Dict:
+        return {'base_url': self.base_url, 'login_screen': flow.login_screen, **values}
+
+    @staticmethod
+    def _format(template: str, values: Dict) -> str:
+        # List values (several labels for one amount) use their first entry outside candidates
+        return template.format(**{key: value[0] if isinstance(value, list) else value for key, value in values.items()})
+
+    @staticmethod
+    def _candidates(step: Dict, values: Dict) -> List[str]:
+        """Expand candidate templates, one candidate per label for list values"""
+        candidates = []
+        for template in step['candidates']:
+            variants = [values]
+            for key, value in values.items():
+                if isinstance(value, list) and f"{{{key}}}" in template:
+                    variants = [{**variant, key: item} for variant in variants for item in value]
+            for variant in variants:
+                candidate = FlowEngine._format(template, variant)
+                if candidate not in candidates:
+                    candidates.append(candidate)
+        return candidates
+
+    async def open_login_screen(self, context: BrowserContext, page: Page, timer: StepTimer):
+        """Reach the player ID login screen, deep-linking there when the session snapshot is warm"""
+        flow = self.flow
+        login_url = self.session_snapshot.login_url if self.session_snapshot.fresh else None
+        if login_url:
+            try:
+                await page.goto(login_url, timeout=60000)
+                if await wait_until_ready(page, selector=flow.login_screen, timeout=5000, step='deep_link') == 'selector':
+                    self.session_snapshot.hits += 1
+                    self._snapshot_pages[page] = self.session_snapshot.captured_at
+                    timer.mark('deep_link')
+                    return
+            except Exception as e:
+                logger.warning(f"Deep link to {login_url} failed: {e}")
+            self.session_snapshot.invalidate("deep link did not reach the login screen")
+        await self.run('login_screen', page, timer, self._values(flow), context)
+
+    async def log_in(self, page: Page, uid: str, timer: StepTimer):
+        """Log in with the player ID and open the UniPin payment page"""
+        await self.run('login', page, timer, self._values(self.flow, uid=uid))
+
+    async def pay(self, page: Page, amount: str, serial: str, pin: str, timer: StepTimer,
+                  before_confirm: Callable[[], None] = None, after_confirm: Callable[[], None] = None) -> Dict:
+        """
+        Select amount and voucher, submit serial and PIN, and return the result.
+
+        `before_confirm` and `after_confirm` run right around the CONFIRM
+        click (e.g. to journal it); see call_hook. Returns the ResultWatcher result dict.
+        """
+        flow = self.flow
+        denomination = self.catalog.get(amount) if self.catalog is not None else None
+        if amount not in flow.amounts and denomination is None:
+            raise FlowError('diamond', f"Invalid amount: {amount}")
+        voucher_label = flow.vouchers.get(serial[:4].upper())
+        if voucher_label is None:
+            raise FlowError('voucher_type', f"Invalid serial code format. Must start with {' or '.join(flow.vouchers)}")
+
+        amount_labels = list(flow.amounts.get(amount, []))
+        if denomination is not None and denomination.label not in amount_labels:
+            amount_labels.insert(0, denomination.label)
+        values = self._values(
+            flow,
+            amount_label=amount_labels,
+            voucher_label=voucher_label,
+            serial=serial,
+            pin=pin.replace('-', '')
+        )
+        if denomination is not None and denomination.selector:
+            values['denomination_selector'] = denomination.selector
+        steps = flow.phases['payment']
+        await self.run_steps(steps[:-1], page, timer, values)
+
+        confirm = steps[-1]
+        try:
+            element = await self._retrying(confirm, flow.before_confirm, lambda: self._find(confirm, page, values))
+        except FlowError as e:
+            self._step_failed(page, e)
+            raise
+        result_config = flow.result
+        try:
+            # Listen for the payment response before clicking so it cannot be missed
+            async with ResultWatcher(page, result_config.get('timeout', 10000),
+                                     result_config.get('response_pattern')) as watcher:
+                await call_hook(before_confirm)
+                await element.click()
+                await call_hook(after_confirm)
+                timer.mark(confirm.get('mark', confirm['name']))
+                result = await watcher.result()
+                # Past CONFIRM only the result is read again, never the form
+                policy = flow.after_confirm
+                for attempt in range(1, policy.attempts):
+                    if result['status'] != 'unknown':
+                        break
+                    STEP_RETRIES.inc(step='result', budget='after_confirm')
+                    await asyncio.sleep(policy.delay(attempt))
+                    result = await watcher.recheck()
+        except Exception as e:
+            raise FlowError(confirm['name'], confirm.get('failure', f"Step {confirm['name']} failed"), str(e),
+                            page_lost=page.is_closed(), confirmed=True)
+        timer.mark('result')
+        return result
+
+    async def run(self, phase: str, page: Page, timer: StepTimer, values: Dict, context: BrowserContext = None):
+        await self.run_steps(self.flow.phases[phase], page, timer, values, context)
+
+    async def run_steps(self, steps: List[Dict], page: Page, timer: StepTimer, values: Dict,
+                        context: BrowserContext = None):
+        try:
+            for step in steps:
+                await self.run_step(step, page, timer, values, context)
+        except FlowError as e:
+            self._step_failed(page, e)
+            raise
+
+    def _step_failed(self, page: Page, error: 'FlowError'):
+        """Drop the session snapshot a page started from when one of its steps fails"""
+        captured_at = self._snapshot_pages.pop(page, None)
+        # A crashed browser says nothing about the snapshot; a newer snapshot was not involved
+        if captured_at is None or error.page_lost or captured_at != self.session_snapshot.captured_at:
+            return
+        self.session_snapshot.invalidate(f"step {error.step} failed on a page started from it")
+
+    async def _find(self, step: Dict, page: Page, values: Dict):
+        element = await self._find_direct(step, page, values)
+        if element is not None:
+            return element
+        element = await self.racer.race(page, step['name'], self._candidates(step, values),
+                                        timeout=step.get('timeout', 5000))
+        if element is None and not step.get('optional'):
+            raise FlowError(step['name'], step.get('error', f"Could not complete step {step['name']}"),
+                            page_lost=page.is_closed())
+        return element
+
+    async def _find_direct(self, step: Dict, page: Page, values: Dict):
+        """The step's `direct` selector, when all its values are known and it is on the page"""
+        try:
+            selector = self._format(step['direct'], values) if step.get('direct') else None
+        except KeyError:
+            return None
+        if not selector:
+            return None
+        try:
+            return await page.wait_for_selector(to_locator(selector), state='visible',
+                                                timeout=step.get('direct_timeout', 2000))
+        except Exception as e:
+            logger.warning(f"Direct selector {selector!r} for step {step['name']} missed, racing candidates: {e}")
+            return None
+
+    async def _retrying(self, step: Dict, policy: RetryPolicy, attempt_step: Callable):
+        """Run `attempt_step` until it succeeds, the budget is spent or the page is gone"""
+        attempts = step.get('attempts', policy.attempts)
+        for attempt in range(1, attempts + 1):
+            try:
+                return await attempt_step()
+            except FlowError as e:
+                if e.page_lost or attempt >= attempts:
+                    raise
+                delay = policy.delay(attempt)
+                logger.warning(f"Step {step['name']} failed ({e}), retrying in {delay:.1f}s")
+                STEP_RETRIES.inc(step=step['name'], budget='before_confirm')
+                await asyncio.sleep(delay)
+
+    async def run_step(self, step: Dict, page: Page, timer: StepTimer, values: Dict,
+                       context: BrowserContext = None):
+        """Perform one step, retrying it on the same page within the before-CONFIRM budget"""
+        await self._retrying(step, self.flow.before_confirm,
+                             lambda: self._run_step_once(step, page, timer, values, context))
+
+    async def _run_step_once(self, step: Dict, page: Page, timer: StepTimer, values: Dict,
+                             context: BrowserContext = None):
+        """Perform one step's action, then wait for its ready condition"""
+        name = step['name']
+        ready = step.get('ready', {})
+        try:
+            left_page = url_changed_from(page) if ready.get('url_changed') else None
+            if step['action'] == 'goto':
+                await page.goto(self._format(step['url'], values), timeout=step.get('timeout', 60000))
+            else:
+                element = await self._find(step, page, values)
+                if element is not None and step['action'] == 'click':
+                    await element.click()
+                elif element is not None and step['action'] == 'fill':
+                    await element.fill(self._format(step['value'], values))
+
+            fired = None
+            if ready:
+                fired = await wait_until_ready(
+                    page,
+                    selector=self._format(ready['selector'], values) if ready.get('selector') else None,
+                    url=left_page,
+                    timeout=ready.get('timeout', 3000),
+                    step=name
+                )
+            if step.get('mark'):
+                timer.mark(step['mark'])
+            if step.get('capture_snapshot') and fired == 'selector' and context is not None:
+                await self.session_snapshot.capture(context, page)
+        except FlowError:
+            raise
+        except Exception as e:
+            raise FlowError(name, step.get('failure', f"Step {name} failed"), str(e), page_lost=page.is_closed())
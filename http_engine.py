@@ -0,0 +1,162 @@
+import os
+import logging
+from typing import Callable, Dict
+import httpx
+from flow_engine import FlowError, FlowLoader, call_hook
+from page_actions import StepTimer, parse_result_payload
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36'
+
+
+class HttpEngine:
+    """
+    Top-up fast path that replays the shop's backend calls without a browser.
+
+    The UI flow wraps three JSON calls: player login by UID, the
+    denomination list and the voucher submission. Their paths come from the
+    `api` section of flow.json. Orders share one keep-alive connection pool
+    (HTTP_MAX_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY) but each gets its own
+    client, so one player's login cookies never leak into another order.
+
+    Failures raise FlowError like FlowEngine. Before the payment request is
+    sent, `confirmed` is False and the caller may fall back to the browser.
+    Once the request may have reached the shop, `confirmed` is True and the
+    voucher must not be submitted again.
+    """
+
+    def __init__(self, base_url: str, loader: FlowLoader = None, max_connections: int = None,
+                 keepalive_expiry: float = None, timeout: float = None, catalog=None):
+        self.base_url = base_url.rstrip('/')
+        self.loader = loader or FlowLoader()
+        # Optional DenominationCatalog; while fresh it replaces the per-order denomination call
+        self.catalog = catalog
+        max_connections = int(
+            max_connections if max_connections is not None else os.environ.get('HTTP_MAX_CONNECTIONS', 10)
+        )
+        keepalive_expiry = float(
+            keepalive_expiry if keepalive_expiry is not None else os.environ.get('HTTP_KEEPALIVE_EXPIRY', 30)
+        )
+        self.timeout = float(timeout if timeout is not None else os.environ.get('HTTP_TIMEOUT', 15))
+        self.transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry
+        ))
+        self.orders = 0
+        self.failures = 0
+
+    def client(self) -> httpx.AsyncClient:
+        """A client with a fresh cookie jar over the shared connection pool"""
+        # Never closed per order: closing a client closes its transport, which is shared
+        return httpx.AsyncClient(
+            transport=self.transport,
+            base_url=self.base_url,
+            headers={'User-Agent': USER_AGENT, 'Accept': 'application/json'},
+            timeout=self.timeout
+        )
+
+    async def top_up(self, uid: str, amount: str, serial: str, pin: str, timer: StepTimer,
+                     before_confirm: Callable[[], None] = None, after_confirm: Callable[[], None] = None,
+                     not_sent: Callable[[], None] = None) -> Dict:
+        """
+        Log in, check the denomination and submit the voucher.
+
+        `before_confirm` and `after_confirm` run right around the payment
+        request, like FlowEngine.pay. `not_sent` undoes `before_confirm` when
+        no connection could be made, so the request never reached the shop.
+        Returns a result dict with 'status',
+        'message', 'transaction_id' and 'source' ('http').
+        """
+        flow = self.loader.current()
+        api = flow.api
+        if not api:
+            raise FlowError('api', "Direct HTTP flow is not configured")
+        denomination = self.catalog.get(amount) if self.catalog is not None else None
+        if amount not in flow.amounts and denomination is None:
+            raise FlowError('api_denominations', f"Invalid amount: {amount}")
+        channel = api.get('channels', {}).get(serial[:4].upper())
+        if channel is None:
+            raise FlowError('api_payment', f"Invalid serial code format. Must start with {' or '.join(flow.vouchers)}")
+
+        self.orders += 1
+        client = self.client()
+        try:
+            await self._log_in(client, api, uid)
+            timer.mark('api_login')
+            if denomination is None:
+                await self._check_denomination(client, api, amount)
+                timer.mark('api_denominations')
+        except FlowError:
+            self.failures += 1
+            raise
+
+        payload = {
+            'app_id': api.get('app_id'),
+            'uid': uid,
+            'amount': amount,
+            'channel': channel,
+            'serial': serial,
+            'pin': pin.replace('-', '')
+        }
+        await call_hook(before_confirm)
+        try:
+            response = await client.post(api['payment'], json=payload)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            # No connection was made, so the voucher cannot have been submitted
+            self.failures += 1
+            await call_hook(not_sent)
+            raise FlowError('api_payment', "Could not reach the shop", str(e))
+        except httpx.HTTPError as e:
+            self.failures += 1
+            raise FlowError('api_payment', "Failed to submit voucher details", str(e), confirmed=True)
+        await call_hook(after_confirm)
+        timer.mark('confirm')
+
+        try:
+            result = parse_result_payload(response.json())
+        except ValueError:
+            logger.warning(f"Unreadable payment response (HTTP {response.status_code})")
+            result = None
+        if result is None:
+            result = {'status': 'unknown', 'message': '', 'transaction_id': None}
+        result['source'] = 'http'
+        timer.mark('result')
+        return result
+
+    @staticmethod
+    async def player_login(client: httpx.AsyncClient, api: Dict, uid: str) -> httpx.Response:
+        """The shop's player ID login call, which also returns the player's nickname"""
+        return await client.post(api['player_login'], json={'app_id': api.get('app_id'), 'uid': uid})
+
+    async def _log_in(self, client: httpx.AsyncClient, api: Dict, uid: str):
+        try:
+            response = await self.player_login(client, api, uid)
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise FlowError('api_login', "Failed to login with UID", str(e))
+        if response.status_code != 200 or not isinstance(data, dict) or data.get('error'):
+            detail = data.get('error') if isinstance(data, dict) else None
+            raise FlowError('api_login', "Failed to login with UID", str(detail or f"HTTP {response.status_code}"))
+        logger.info(f"Logged in over HTTP as {data.get('nickname', uid)}")
+
+    async def _check_denomination(self, client: httpx.AsyncClient, api: Dict, amount: str):
+        try:
+            response = await client.get(api['denominations'], params={'app_id': api.get('app_id')})
+            response.raise_for_status()
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise FlowError('api_denominations', "Failed to select diamond amount", str(e))
+        denominations = data.get('denominations', []) if isinstance(data, dict) else data
+        if not any(str(denomination.get('amount')) == amount for denomination in denominations):
+            raise FlowError('api_denominations', "Could not find diamond amount", amount)
+
+    async def stop(self):
+        await self.transport.aclose()
+
+    def stats(self) -> Dict:
+        return {
+            'orders': self.orders,
+            'failures': self.failures
+        }
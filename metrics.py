@@ -0,0 +1,170 @@
+import bisect
+import logging
+from typing import Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+# Upper bounds (seconds) for single steps and for whole orders
+STEP_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+ORDER_BUCKETS = (5, 10, 20, 30, 45, 60, 90, 120, 180, 300)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Dict[str, str] = None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """Base for a labelled metric family rendered in the Prometheus text format"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = STEP_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts (last one is +Inf), sum
+        self.values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values[key] = (counts, total + value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics exposed together on /metrics"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+STEP_SECONDS = REGISTRY.register(Histogram(
+    'topup_step_seconds', "Duration of each top-up step",
+    ('engine', 'step', 'amount', 'voucher'), STEP_BUCKETS
+))
+ORDER_SECONDS = REGISTRY.register(Histogram(
+    'topup_order_seconds', "Duration of whole top-up orders",
+    ('engine', 'amount', 'voucher', 'outcome'), ORDER_BUCKETS
+))
+ORDERS = REGISTRY.register(Counter(
+    'topup_orders_total', "Finished top-up orders by outcome",
+    ('engine', 'outcome')
+))
+SELECTOR_FALLBACKS = REGISTRY.register(Counter(
+    'topup_selector_fallbacks_total', "Steps won by a candidate other than the best ranked one",
+    ('step',)
+))
+TIMEOUTS = REGISTRY.register(Counter(
+    'topup_timeouts_total', "Selector races that matched nothing and readiness waits that ran out",
+    ('kind', 'step')
+))
+STEP_RETRIES = REGISTRY.register(Counter(
+    'topup_step_retries_total', "Flow steps retried, result reads repeated and orders resumed on a new page",
+    ('step', 'budget')
+))
+HTTP_FALLBACKS = REGISTRY.register(Counter(
+    'topup_http_fallbacks_total', "HTTP fast-path orders handed to the browser, by the step that failed",
+    ('step',)
+))
+QUEUE = REGISTRY.register(Gauge(
+    'topup_queue_orders', "Orders waiting for or running on a browser worker",
+    ('state',)
+))
+BROWSER_POOL = REGISTRY.register(Gauge(
+    'topup_browser_pool', "Browser pool size and leased contexts",
+    ('kind',)
+))
+MEMORY = REGISTRY.register(Gauge(
+    'topup_memory_bytes', "Resident memory of the bot process, its Chromium children and the busiest browser",
+    ('process',)
+))
+MEMORY_ACTIONS = REGISTRY.register(Counter(
+    'topup_memory_actions_total', "Contexts refused over the memory budget and browsers recycled over their ceiling",
+    ('action',)
+))
+
+
+def observe_timer(timer) -> None:
+    """StepTimer observer: export one finished order's step and total durations"""
+    engine = timer.labels.get('engine', 'unknown')
+    amount = timer.labels.get('amount', 'unknown')
+    voucher = timer.labels.get('voucher', 'unknown')
+    for step, elapsed in timer.timings:
+        STEP_SECONDS.observe(elapsed, engine=engine, step=step, amount=amount, voucher=voucher)
+    outcome = timer.outcome or 'unknown'
+    ORDER_SECONDS.observe(timer.total, engine=engine, amount=amount, voucher=voucher, outcome=outcome)
+    ORDERS.inc(engine=engine, outcome=outcome)
@@ -0,0 +1,309 @@
+"""
+Local stand-in for the Garena shop, for benchmarks and dry runs.
+
+Reproduces the pages the top-up flow walks through - game tile, player ID
+login, UniPin channel, denominations, Physical Vouchers, serial/PIN form and
+the success or error result - and the JSON calls behind them (player
+login, denomination list, payment submission) used by the HTTP fast path,
+with configurable latency and failure injection, so no live voucher is
+ever spent.
+
+    python mock_shop.py --port 8080 --latency 50 --api-latency 300 --fail-rate 0.1
+    GARENA_SHOP_URL=http://127.0.0.1:8080 python app.py
+"""
+import json
+import time
+import random
+import base64
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Set
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+DENOMINATIONS = [
+    ('25', '25 Diamond'),
+    ('50', '50 Diamond'),
+    ('115', '115 Diamond'),
+    ('240', '240 Diamond'),
+    ('500', '500 Diamond'),
+    ('610', '610 Diamond'),
+    ('1240', '1,240 Diamond'),
+    ('2530', '2,530 Diamond')
+]
+
+# 1x1 PNG for the game tile
+TILE_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+)
+
+STYLE = """
+<style>
+  body { font-family: sans-serif; }
+  .tile img { width: 120px; height: 120px; cursor: pointer; }
+  .channel, .denom, .voucher-option, .dropdown { padding: 12px; margin: 6px; border: 1px solid #ccc; cursor: pointer; }
+  .hidden { display: none; }
+</style>
+"""
+
+
+def _page(title: str, body: str, script: str = '') -> bytes:
+    return (
+        f"<!DOCTYPE html><html><head><title>{title}</title>{STYLE}</head>"
+        f"<body><main>{body}</main><script>{script}</script></body></html>"
+    ).encode('utf-8')
+
+
+LANDING = _page('Garena Shop', """
+<h1>Garena Topup Center</h1>
+<section class="games">
+  <a class="tile" href="/app/100067/idlogin"><img alt="Free Fire" src="/img/freefire.png"></a>
+</section>
+""")
+
+LOGIN = _page('Free Fire', """
+<h1>Free Fire</h1>
+<section id="login">
+  <input type="text" name="player_id" placeholder="Please enter player ID here">
+  <button id="login-button" type="button">Login</button>
+  <p id="login-error" class="hidden">Invalid player ID</p>
+</section>
+<section id="channels" class="hidden">
+  <p id="nickname"></p>
+  <div class="channel unipin">UniPin Credits & Voucher</div>
+  <button id="proceed" type="button">Proceed to Payment</button>
+</section>
+""", """
+let uid = null;
+document.getElementById('login-button').onclick = async () => {
+  uid = document.querySelector('input[name=player_id]').value;
+  const response = await fetch('/api/auth/player_id_login', {
+    method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({uid})
+  });
+  const data = await response.json();
+  if (!response.ok || data.error) {
+    document.getElementById('login-error').classList.remove('hidden');
+    return;
+  }
+  document.getElementById('nickname').textContent = 'Player: ' + data.nickname;
+  document.getElementById('login').classList.add('hidden');
+  document.getElementById('channels').classList.remove('hidden');
+};
+document.querySelector('.channel').onclick = (event) => event.target.classList.add('selected');
+document.getElementById('proceed').onclick = () => {
+  window.location.href = '/app/100067/buy/unipin?uid=' + encodeURIComponent(uid);
+};
+""")
+
+
+def _payment_page() -> bytes:
+    denominations = "\n".join(
+        f'<div class="denom" id="denom-{amount}" data-amount="{amount}">{label}</div>'
+        for amount, label in DENOMINATIONS
+    )
+    return _page('Payment', f"""
+<h1>Free Fire Diamonds</h1>
+<section id="denominations">{denominations}</section>
+<section id="payment-channel" class="hidden">
+  <h2>Select Payment Channel</h2>
+  <div class="dropdown" id="physical">Physical Vouchers</div>
+  <section id="voucher-options" class="hidden">
+    <div class="voucher-option" data-channel="unipin">UniPin Voucher</div>
+    <div class="voucher-option" data-channel="upgiftcard">UP Gift Card</div>
+  </section>
+</section>
+<form id="voucher-form" class="hidden">
+  <input type="text" name="serial" placeholder="Serial Number">
+  <input type="text" name="pin" placeholder="PIN">
+  <button type="submit">CONFIRM</button>
+</form>
+""", """
+const params = new URLSearchParams(window.location.search);
+let amount = null, channel = null;
+document.querySelectorAll('.denom').forEach((denom) => denom.onclick = () => {
+  amount = denom.dataset.amount;
+  document.getElementById('payment-channel').classList.remove('hidden');
+});
+document.getElementById('physical').onclick = () => {
+  document.getElementById('voucher-options').classList.remove('hidden');
+};
+document.querySelectorAll('.voucher-option').forEach((option) => option.onclick = () => {
+  channel = option.dataset.channel;
+  document.getElementById('voucher-form').classList.remove('hidden');
+});
+document.getElementById('voucher-form').onsubmit = async (event) => {
+  event.preventDefault();
+  const form = new FormData(event.target);
+  const response = await fetch('/api/payment/submit', {
+    method: 'POST', headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify({uid: params.get('uid'), amount, channel, serial: form.get('serial'), pin: form.get('pin')})
+  });
+  const data = await response.json();
+  const query = new URLSearchParams({status: data.status, message: data.message || '', txn: data.transaction_id || ''});
+  window.location.href = '/result?' + query.toString();
+};
+""")
+
+
+PAYMENT = _payment_page()
+
+
+def _result_page(status: str, message: str, transaction_id: str) -> bytes:
+    if status == 'success':
+        body = f"<h1>Transaction successful</h1><p>Payment Completed</p><p>Transaction ID: {transaction_id}</p>"
+    else:
+        body = f"<h1>Transaction failed</h1><p class='error'>{message}</p>"
+    return _page('Result', body)
+
+
+class MockShop:
+    """
+    Threaded HTTP server imitating the shop.
+
+    `latency_ms` delays every page and asset, `api_latency_ms` delays the
+    JSON calls (player login, denominations, payment submission) and `failure_rate` is the
+    probability that a payment submission fails with a server error.
+    Serials are consumed on success, so resubmitting one yields
+    "Consumed Voucher" like the real shop.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0, api_latency_ms: float = 0,
+                 failure_rate: float = 0.0, seed: int = None):
+        self.latency_ms = latency_ms
+        self.api_latency_ms = api_latency_ms
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.consumed: Set[str] = set()
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'MockShop':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-shop', daemon=True)
+        self._thread.start()
+        logger.info(f"Mock shop listening on {self.url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, path: str):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def player_login(self, payload: Dict):
+        uid = str(payload.get('uid', ''))
+        if not uid.isdigit() or len(uid) < 6:
+            return 400, {'error': 'invalid_id'}
+        return 200, {'uid': uid, 'nickname': f"Player{uid[-4:]}", 'region': 'MY'}
+
+    def denominations(self):
+        return 200, {'denominations': [
+            {'id': f"denom-{amount}", 'amount': amount, 'label': label} for amount, label in DENOMINATIONS
+        ]}
+
+    def submit_payment(self, payload: Dict):
+        serial = str(payload.get('serial', '')).upper()
+        pin = str(payload.get('pin', '')).replace('-', '')
+        with self._lock:
+            if self.random.random() < self.failure_rate:
+                return 500, {'status': 'error', 'message': 'Error: service temporarily unavailable'}
+            if serial in self.consumed:
+                return 200, {'status': 'error', 'message': 'Consumed Voucher'}
+            if not pin.isdigit() or len(pin) != 16:
+                return 200, {'status': 'error', 'message': 'Invalid PIN'}
+            self.consumed.add(serial)
+            transaction_id = f"TXN{self.random.randrange(10 ** 9):09d}"
+        return 200, {'status': 'success', 'transaction_id': transaction_id}
+
+    def _handler_class(self):
+        shop = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, status: int, payload: Dict):
+                self._send(status, json.dumps(payload).encode('utf-8'), 'application/json')
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                shop._count(parsed.path)
+                time.sleep(shop.latency_ms / 1000)
+                if parsed.path == '/':
+                    self._send(200, LANDING, 'text/html; charset=utf-8')
+                elif parsed.path == '/img/freefire.png':
+                    self._send(200, TILE_PNG, 'image/png')
+                elif parsed.path == '/app/100067/idlogin':
+                    self._send(200, LOGIN, 'text/html; charset=utf-8')
+                elif parsed.path == '/app/100067/buy/unipin':
+                    self._send(200, PAYMENT, 'text/html; charset=utf-8')
+                elif parsed.path == '/api/denominations':
+                    time.sleep(shop.api_latency_ms / 1000)
+                    self._send_json(*shop.denominations())
+                elif parsed.path == '/result':
+                    query = parse_qs(parsed.query)
+                    self._send(200, _result_page(
+                        query.get('status', [''])[0],
+                        query.get('message', [''])[0],
+                        query.get('txn', [''])[0]
+                    ), 'text/html; charset=utf-8')
+                else:
+                    self._send(404, b'Not Found', 'text/plain')
+
+            def do_POST(self):
+                parsed = urlparse(self.path)
+                shop._count(parsed.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    payload = {}
+                time.sleep(shop.api_latency_ms / 1000)
+                if parsed.path == '/api/auth/player_id_login':
+                    self._send_json(*shop.player_login(payload))
+                elif parsed.path == '/api/payment/submit':
+                    self._send_json(*shop.submit_payment(payload))
+                else:
+                    self._send_json(404, {'error': 'not_found'})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the local mock Garena shop")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help="delay per page/asset in ms")
+    parser.add_argument('--api-latency', type=float, default=0, help="delay per API call in ms")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="probability a payment fails")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    shop = MockShop(args.host, args.port, args.latency, args.api_latency, args.fail_rate).start()
+    try:
+        shop._thread.join()
+    except KeyboardInterrupt:
+        shop.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Order states, in the order an order walks through them
+QUEUED = 'queued'
+BROWSER_STARTED = 'browser_started'
+CONFIRMING = 'confirming'
+CONFIRMED = 'confirmed'
+RESULT = 'result'
+# Written on startup for orders the previous process left in flight
+INTERRUPTED = 'interrupted'
+UNKNOWN = 'unknown'
+# An admin checked a blocked serial and found the voucher unspent
+CLEARED = 'cleared'
+
+IN_FLIGHT = {QUEUED, BROWSER_STARTED, CONFIRMING, CONFIRMED}
+# From here on the voucher may have been consumed
+PAST_CONFIRM = {CONFIRMING, CONFIRMED}
+
+
+class OrderJournal:
+    """
+    Append-only JSON-lines journal of order state transitions, keyed by serial.
+
+    PINs are never written. Records are buffered and written every
+    `flush_interval` seconds ('batch' mode), or written and fsynced on every
+    append ('always'); 'off' leaves syncing to the OS. Transitions around
+    CONFIRM are always written durably before the flow continues. On start the
+    journal is replayed so in-flight orders can be flagged and a serial is
+    never submitted twice.
+    """
+
+    def __init__(self, path: str = None, fsync: str = None, flush_interval: float = None):
+        self.path = path or os.environ.get('ORDER_JOURNAL_PATH', 'orders.jsonl')
+        self.fsync = fsync or os.environ.get('ORDER_JOURNAL_FSYNC', 'batch')
+        self.flush_interval = float(
+            flush_interval if flush_interval is not None else os.environ.get('ORDER_JOURNAL_FLUSH_INTERVAL', 1.0)
+        )
+        # Latest known record per serial
+        self.orders: Dict[str, Dict] = {}
+        # Serials a conversation has claimed but not yet journalled as QUEUED
+        self.reserved: Set[str] = set()
+        self._buffer: List[str] = []
+        self._file = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    def replay(self) -> List[Dict]:
+        """Load the journal and return the orders left in flight by the last run"""
+        self.orders.clear()
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as journal:
+                for line_number, line in enumerate(journal, 1):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        logger.warning(f"Skipping unreadable journal line {line_number}")
+                        continue
+                    self._apply(record)
+        return [record for record in self.orders.values() if record['state'] in IN_FLIGHT]
+
+    def _apply(self, record: Dict):
+        previous = self.orders.get(record['serial'], {})
+        merged = {**previous, **record}
+        # Remember whether any attempt on this serial got past CONFIRM, until the shop
+        # rejected it outright, the submission never left (the voucher was not spent)
+        # or an admin cleared it
+        if record['state'] == CLEARED or record.get('unsent') or (record['state'] == RESULT and record.get('rejected')):
+            merged['past_confirm'] = False
+        else:
+            merged['past_confirm'] = previous.get('past_confirm', False) or record['state'] in PAST_CONFIRM
+        self.orders[record['serial']] = merged
+
+    async def start(self):
+        """Open the journal for appending and start the batch flusher"""
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if self.fsync == 'batch':
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        if self._file is not None:
+            self.flush(sync=True)
+            self._file.close()
+            self._file = None
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush(sync=True)
+
+    def record(self, serial: str, state: str, durable: bool = False, **fields):
+        """Append one state transition; `durable` forces a write and fsync now"""
+        record = {'ts': time.time(), 'serial': serial, 'state': state, **fields}
+        record.pop('pin', None)
+        self._apply(record)
+        self._buffer.append(json.dumps(record, ensure_ascii=False) + "\n")
+        if durable or self.fsync == 'always':
+            self.flush(sync=True)
+        elif self.fsync != 'batch':
+            self.flush(sync=False)
+
+    def flush(self, sync: bool = False):
+        """Write buffered records, optionally fsyncing the file"""
+        if self._file is None or not self._buffer:
+            return
+        try:
+            self._file.writelines(self._buffer)
+            self._buffer.clear()
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+        except OSError as e:
+            logger.error(f"Could not write order journal: {e}")
+
+    def can_submit(self, serial: str) -> bool:
+        """
+        False while the serial is reserved or in flight, or once an attempt got
+        past CONFIRM without a definite rejection from the shop (see clear).
+        """
+        if serial in self.reserved:
+            return False
+        record = self.orders.get(serial)
+        if record is None:
+            return True
+        if record['state'] in IN_FLIGHT or record['state'] == UNKNOWN:
+            return False
+        return not record.get('past_confirm', False)
+
+    def reserve(self, serial: str) -> bool:
+        """
+        Claim a serial for one submission; False if it cannot be submitted.
+
+        Check and claim happen without an await in between, so two
+        conversations can never both pass. Release the reservation once the
+        order is journalled as QUEUED, or when it is refused.
+        """
+        if not self.can_submit(serial):
+            return False
+        self.reserved.add(serial)
+        return True
+
+    def release(self, serial: str):
+        self.reserved.discard(serial)
+
+    def clear(self, serial: str, admin_id: int) -> bool:
+        """Unblock a serial an admin found unspent; False while it is still in flight"""
+        record = self.orders.get(serial)
+        if record is not None and record['state'] in IN_FLIGHT:
+            return False
+        self.record(serial, CLEARED, durable=True, admin_id=admin_id)
+        return True
+
+    def recover(self, still_running: Set[str] = None) -> List[Dict]:
+        """
+        Flag the orders the previous process left in flight.
+
+        Orders that never reached CONFIRM are marked interrupted and may be
+        resubmitted; the others are marked unknown and their serial stays
+        blocked until an admin has checked the voucher and cleared it.
+        Serials in `still_running` (handed to worker processes that outlive
+        this one) are left in flight.
+        """
+        flagged = []
+        for record in self.replay():
+            if still_running and record['serial'] in still_running:
+                continue
+            state = UNKNOWN if record['state'] in PAST_CONFIRM else INTERRUPTED
+            self.record(record['serial'], state, durable=True, previous_state=record['state'])
+            flagged.append(self.orders[record['serial']])
+        if flagged:
+            logger.warning(f"Recovered {len(flagged)} in-flight orders from the journal")
+        return flagged
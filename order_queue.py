@@ -0,0 +1,278 @@
+import os
+import time
+import asyncio
+import logging
+from collections import Counter, OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when an order is submitted above the queue's high-water mark"""
+
+
+class RateLimited(QueueFull):
+    """Raised when a user (or everyone together) submits orders faster than allowed"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateWindow:
+    """Sliding one-minute window of submission times; a limit of 0 means unlimited"""
+
+    def __init__(self, limit: int, window: float = 60):
+        self.limit = limit
+        self.window = window
+        self.times: Deque[float] = deque()
+
+    def retry_after(self, now: float) -> float:
+        """Seconds until another submission is allowed, 0 if it is allowed now"""
+        while self.times and now - self.times[0] >= self.window:
+            self.times.popleft()
+        if not self.limit or len(self.times) < self.limit:
+            return 0
+        return self.window - (now - self.times[0])
+
+    def add(self, now: float):
+        self.times.append(now)
+
+
+class Order:
+    """One top-up request waiting for, or running on, a browser worker"""
+
+    def __init__(self, uid: str, amount: str, serial: str, pin: str, user_id: int = None,
+                 on_position: Callable[[Optional[int]], Awaitable] = None,
+                 handler: Callable[['Order'], Awaitable[str]] = None, engine: str = None, batch: bool = False):
+        self.uid = uid
+        self.amount = amount
+        self.serial = serial
+        self.pin = pin
+        self.user_id = user_id
+        # Called with the number of orders ahead, or None once the order starts
+        self.on_position = on_position
+        # Runs this order instead of the queue's handler (e.g. a batch of vouchers for one UID)
+        self.handler = handler
+        # 'browser' or 'http'; None uses the default engine
+        self.engine = engine
+        # One UID group of a /batch; capped by the queue's batch_concurrency instead of user_concurrency
+        self.batch = batch
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._reported = -1
+        self._last_update: Optional[asyncio.Task] = None
+
+
+class OrderQueue:
+    """
+    Bounded, fair queue of top-up orders served by a fixed number of workers.
+
+    Only `workers` orders drive a browser at once; the rest wait in line and
+    are told their position whenever it changes. Waiting orders are kept per
+    Telegram user and served round-robin, so one user's repeated orders
+    cannot take every worker; users in `vip_ids` are served before everyone
+    else, still round-robin among themselves. A user never has more than
+    `user_concurrency` (USER_MAX_RUNNING) orders running. Batch groups are
+    capped separately by `batch_concurrency` (BATCH_MAX_RUNNING, default
+    every worker) so a reseller's /batch still fans out across the pool;
+    they stay in the user's round-robin turn, so other users' orders are
+    still interleaved with them. Submissions above `user_rate`
+    (USER_ORDERS_PER_MINUTE) per user or `global_rate` (ORDERS_PER_MINUTE,
+    0 = unlimited) overall are refused with RateLimited. Above
+    `high_water` waiting orders new submissions are refused instead of
+    piling up.
+    """
+
+    def __init__(self, handler: Callable[[Order], Awaitable[str]], workers: int = None, high_water: int = None,
+                 user_concurrency: int = None, user_rate: int = None, global_rate: int = None,
+                 vip_ids: Set[int] = None, batch_concurrency: int = None):
+        self.handler = handler
+        self.workers = int(workers if workers is not None else os.environ.get('ORDER_WORKERS', 2))
+        self.high_water = int(high_water if high_water is not None else os.environ.get('ORDER_QUEUE_MAX', 20))
+        self.user_concurrency = int(
+            user_concurrency if user_concurrency is not None else os.environ.get('USER_MAX_RUNNING', 1)
+        )
+        self.batch_concurrency = int(
+            batch_concurrency if batch_concurrency is not None else os.environ.get('BATCH_MAX_RUNNING', self.workers)
+        )
+        self.user_rate = int(user_rate if user_rate is not None else os.environ.get('USER_ORDERS_PER_MINUTE', 6))
+        self.global_rate = RateWindow(
+            int(global_rate if global_rate is not None else os.environ.get('ORDERS_PER_MINUTE', 0))
+        )
+        self.vip_ids: Set[int] = set(vip_ids or ())
+
+        # Waiting orders per user; the first user is the next to be served
+        self._waiting: 'OrderedDict[Optional[int], Deque[Order]]' = OrderedDict()
+        self._rates: Dict[Optional[int], RateWindow] = {}
+        self._running_by_user: Counter = Counter()
+        # Woken whenever an order is submitted or a user's order finishes
+        self._changed = asyncio.Condition()
+        self._tasks: List[asyncio.Task] = []
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    async def start(self):
+        """Spawn the worker tasks"""
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(index), name=f"order-worker-{index}"))
+        logger.info(f"Order queue started with {self.workers} workers, high-water mark {self.high_water}")
+
+    async def stop(self):
+        """Cancel the workers; waiting orders are failed"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        for orders in self._waiting.values():
+            for order in orders:
+                if not order.result.done():
+                    order.result.set_exception(asyncio.CancelledError())
+        self._waiting.clear()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(orders) for orders in self._waiting.values())
+
+    def retry_after(self, user_id: Optional[int]) -> float:
+        """Seconds until `user_id` may submit another order, 0 if they may now"""
+        now = time.monotonic()
+        user_wait = 0
+        user_rate = self._rates.get(user_id)
+        if user_rate is not None:
+            user_wait = user_rate.retry_after(now)
+            if not user_rate.times:
+                del self._rates[user_id]
+        return max(self.global_rate.retry_after(now), user_wait)
+
+    def submit(self, order: Order, rate_limit: bool = True) -> int:
+        """
+        Queue an order and return how many orders are ahead of it.
+
+        Raises QueueFull above the high-water mark and RateLimited when the
+        order's user is over their rate; `rate_limit=False` submits without
+        counting against it (the rest of a batch).
+        """
+        if self.waiting >= self.high_water:
+            self.rejected += 1
+            raise QueueFull(f"{self.waiting} orders already waiting")
+        if rate_limit:
+            retry_after = self.retry_after(order.user_id)
+            if retry_after:
+                self.rate_limited += 1
+                raise RateLimited(f"user {order.user_id} is over the order rate", retry_after)
+            now = time.monotonic()
+            self.global_rate.add(now)
+            self._rates.setdefault(order.user_id, RateWindow(self.user_rate)).add(now)
+
+        self._waiting.setdefault(order.user_id, deque()).append(order)
+        schedule = self._schedule()
+        for ahead, waiting in enumerate(schedule):
+            self._report(waiting, ahead)
+        self._notify()
+        return schedule.index(order)
+
+    def _notify(self):
+        async def notify():
+            async with self._changed:
+                self._changed.notify_all()
+        asyncio.create_task(notify())
+
+    def _schedule(self) -> List[Order]:
+        """Waiting orders in the order they are expected to start"""
+        scheduled = []
+        for vip in (True, False):
+            queues = [list(orders) for user_id, orders in self._waiting.items() if (user_id in self.vip_ids) == vip]
+            for turn in range(max((len(orders) for orders in queues), default=0)):
+                scheduled.extend(orders[turn] for orders in queues if turn < len(orders))
+        return scheduled
+
+    def _report_positions(self):
+        for ahead, order in enumerate(self._schedule()):
+            self._report(order, ahead)
+
+    def _next_order(self) -> Optional[Order]:
+        """Pop the next order round-robin, VIPs first, skipping users at their concurrency limit"""
+        for vip in (True, False):
+            for user_id, orders in self._waiting.items():
+                if (user_id in self.vip_ids) != vip:
+                    continue
+                limit = self.batch_concurrency if orders[0].batch else self.user_concurrency
+                if self._running_by_user[user_id] >= limit:
+                    continue
+                order = orders.popleft()
+                if orders:
+                    # This user goes to the back of the round
+                    self._waiting.move_to_end(user_id)
+                else:
+                    del self._waiting[user_id]
+                return order
+        return None
+
+    def _report(self, order: Order, ahead: Optional[int]):
+        """Tell an order its position, only when it changed"""
+        position = -2 if ahead is None else ahead
+        if order.on_position is None or order._reported == position:
+            return
+        order._reported = position
+        order._last_update = asyncio.create_task(self._call(order, ahead, order._last_update))
+
+    async def _call(self, order: Order, ahead: Optional[int], previous: Optional[asyncio.Task]):
+        # Deliver updates of one order in the order they were made
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await order.on_position(ahead)
+        except Exception as e:
+            logger.warning(f"Queue position update failed: {e}")
+
+    async def _worker(self, index: int):
+        while True:
+            async with self._changed:
+                order = self._next_order()
+                while order is None:
+                    await self._changed.wait()
+                    order = self._next_order()
+
+            self._report(order, None)
+            self._report_positions()
+
+            self.running += 1
+            self._running_by_user[order.user_id] += 1
+            try:
+                result = await (order.handler or self.handler)(order)
+                # Whoever awaited the order may have been cancelled meanwhile
+                if not order.result.done():
+                    order.result.set_result(result)
+            except Exception as e:
+                logger.error(f"Worker {index} failed order {order.serial}: {e}")
+                if not order.result.done():
+                    order.result.set_exception(e)
+            finally:
+                self.running -= 1
+                self.completed += 1
+                self._running_by_user[order.user_id] -= 1
+                if not self._running_by_user[order.user_id]:
+                    del self._running_by_user[order.user_id]
+                # The user's next order may now be eligible
+                self._notify()
+
+    @property
+    def alive(self) -> bool:
+        """True while every worker task is still running"""
+        return bool(self._tasks) and not any(task.done() for task in self._tasks)
+
+    def stats(self) -> Dict:
+        return {
+            'waiting': self.waiting,
+            'running': self.running,
+            'workers': self.workers,
+            'high_water': self.high_water,
+            'users_waiting': len(self._waiting),
+            'vip_waiting': sum(len(orders) for user_id, orders in self._waiting.items() if user_id in self.vip_ids),
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'rate_limited': self.rate_limited
+        }
@@ -0,0 +1,21 @@
+from typing import Tuple
+from denomination_catalog import DenominationCatalog
+
+
+async def validate_inputs(catalog: DenominationCatalog, uid: str, amount: str, serial: str,
+                          pin: str) -> Tuple[bool, str]:
+    """Validate an order's fields, checking the amount against `catalog`"""
+    if not uid or len(uid) < 5:
+        return False, "Invalid UID"
+    
+    valid_amounts = list(await catalog.current())
+    if amount not in valid_amounts:
+        return False, f"Invalid amount. Choose from: {', '.join(valid_amounts)}"
+    
+    if not serial or len(serial) < 10:
+        return False, "Invalid serial code"
+    
+    if not pin or len(pin.replace('-', '')) != 16:
+        return False, "Invalid PIN format. Should be 16 digits (with or without dashes)"
+    
+    return True, "Valid"
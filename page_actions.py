@@ -0,0 +1,328 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from playwright.async_api import Page, ElementHandle
+from selector_stats import SelectorScoreboard
+from metrics import SELECTOR_FALLBACKS, TIMEOUTS, observe_timer
+
+logger = logging.getLogger(__name__)
+
+UrlMatcher = Union[str, Callable[[str], bool]]
+ResponseMatcher = Union[str, Callable[[object], bool]]
+
+# Any result message the shop shows after CONFIRM
+RESULT_TEXT = "text=/successful|Payment Completed|Success|Berjaya|Consumed Voucher|Invalid|Error|Failed/i"
+SUCCESS_STATUSES = {'success', 'succeeded', 'ok', 'completed', 'paid'}
+FAILURE_STATUSES = {'error', 'failed', 'fail', 'failure', 'rejected'}
+
+# Reads the result shown on the page in a single round trip
+READ_RESULT_JS = """
+() => {
+  const text = document.body ? document.body.innerText : '';
+  const lines = text.split('\\n').map((line) => line.trim()).filter(Boolean);
+  const find = (pattern) => lines.find((line) => pattern.test(line)) || null;
+  const transaction = text.match(/Transaction\\s*(?:ID|No\\.?|Number)?\\s*[:#]\\s*([A-Z0-9-]*\\d[A-Z0-9-]*)/i);
+  return {
+    success: find(/Transaction successful|Payment Completed|Success|Berjaya/i),
+    failure: find(/Consumed Voucher|Invalid|Error|Failed/i),
+    transaction_id: transaction ? transaction[1] : null,
+    url: location.href
+  };
+}
+"""
+
+
+async def wait_until_ready(page: Page, selector: str = None, url: UrlMatcher = None,
+                           response: ResponseMatcher = None, timeout: float = 3000, step: str = 'unknown') -> str:
+    """
+    Wait until the page signals it is ready for the next step.
+
+    Any of the given conditions may fire first: `selector` becoming visible,
+    the page URL matching `url` (glob or predicate), or a network response
+    whose URL contains `response` (or matches a predicate). `timeout` (ms) is
+    only an upper bound - the old fixed pause - after which the flow carries
+    on anyway. Returns the name of the condition that fired, or 'timeout',
+    which is counted against `step` in the metrics.
+    """
+    waiters = {}
+    if selector:
+        waiters['selector'] = page.wait_for_selector(selector, state='visible', timeout=timeout)
+    if url:
+        waiters['url'] = page.wait_for_url(url, timeout=timeout)
+    if response:
+        predicate = response if callable(response) else (lambda r: response in r.url)
+        waiters['response'] = page.wait_for_event('response', predicate=predicate, timeout=timeout)
+
+    if not waiters:
+        await asyncio.sleep(timeout / 1000)
+        return 'timeout'
+
+    tasks = {asyncio.ensure_future(coro): name for name, coro in waiters.items()}
+    pending = set(tasks)
+    fired = 'timeout'
+    try:
+        while pending and fired == 'timeout':
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None:
+                    fired = tasks[task]
+                    break
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    if fired == 'timeout':
+        TIMEOUTS.inc(kind='readiness', step=step)
+    return fired
+
+
+def url_changed_from(page: Page) -> Callable[[str], bool]:
+    """URL predicate that holds once the page has navigated away from its current URL"""
+    start_url = page.url
+    return lambda current: current != start_url
+
+
+def to_locator(selector: str) -> str:
+    """Playwright selector for a candidate, treating '//...' as XPath"""
+    return f"xpath={selector}" if selector.startswith('//') else selector
+
+
+class SelectorRacer:
+    """
+    Races all candidate selectors of a step at once and takes the first match.
+
+    Every race is scored on the SelectorScoreboard, which ranks candidates by
+    hit rate and match latency. Ranking decides between candidates that are
+    on the page at the same time, and candidates that keep losing are pruned
+    from the race, only tried again when the active ones all miss.
+    """
+
+    def __init__(self, scoreboard: SelectorScoreboard = None):
+        self.scoreboard = scoreboard or SelectorScoreboard(path=':memory:')
+
+    async def race(self, page: Page, step: str, selectors: List[str], timeout: float = 5000,
+                   state: str = 'visible') -> Optional[ElementHandle]:
+        """
+        Wait for all candidates in parallel and return the winning element.
+
+        The whole race is bounded by a single `timeout` (ms) instead of one
+        timeout per candidate. Returns None when no candidate matched.
+        """
+        active, pruned = self.scoreboard.split(step, selectors)
+        for candidates in (active, pruned):
+            if not candidates:
+                continue
+            started = time.perf_counter()
+            match = await self._race(page, candidates, timeout, state)
+            latency_ms = (time.perf_counter() - started) * 1000
+            winner = match[0] if match else None
+            self.scoreboard.record_race(step, candidates, winner, latency_ms)
+            if match:
+                if candidates is pruned or winner != candidates[0]:
+                    SELECTOR_FALLBACKS.inc(step=step)
+                logger.debug(f"Step '{step}' matched selector {winner!r} in {latency_ms:.0f}ms")
+                return match[1]
+
+        logger.warning(f"No selector matched for step '{step}'")
+        TIMEOUTS.inc(kind='selector', step=step)
+        return None
+
+    async def _race(self, page: Page, ranked: List[str], timeout: float,
+                    state: str) -> Optional[Tuple[str, ElementHandle]]:
+        tasks = {
+            asyncio.ensure_future(page.wait_for_selector(to_locator(selector), state=state, timeout=timeout)): selector
+            for selector in ranked
+        }
+        pending = set(tasks)
+        matches: Dict[str, ElementHandle] = {}
+        try:
+            while pending and not matches:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None and task.result() is not None:
+                        matches[tasks[task]] = task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if not matches:
+            return None
+
+        winner = min(matches, key=ranked.index)
+        # A better ranked candidate may be on the page too; prefer it like the old cascade did
+        for selector in ranked[:ranked.index(winner)]:
+            element = await page.query_selector(to_locator(selector))
+            if element and await element.is_visible():
+                matches[selector] = element
+                winner = selector
+                break
+        return winner, matches[winner]
+
+
+class StepTimer:
+    """
+    Records how long each step of one order took.
+
+    `labels` (engine, amount, voucher) break the exported metrics down;
+    the outcome is given when the timer is finished.
+    """
+
+    # Callbacks run with every finished timer (metrics, benchmarks)
+    observers: List[Callable[['StepTimer'], None]] = [observe_timer]
+
+    def __init__(self, label: str, **labels: str):
+        self.label = label
+        self.labels = labels
+        self.outcome: Optional[str] = None
+        self.timings: List[Tuple[str, float]] = []
+        self._started = time.perf_counter()
+        self._last = self._started
+        self._finished: Optional[float] = None
+
+    def mark(self, step: str) -> float:
+        """Close the current step and return its duration in seconds"""
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.timings.append((step, elapsed))
+        return elapsed
+
+    @property
+    def total(self) -> float:
+        return (self._finished or time.perf_counter()) - self._started
+
+    def summary(self) -> str:
+        steps = " ".join(f"{step}={elapsed:.2f}s" for step, elapsed in self.timings)
+        return f"{self.label}: {steps} total={self.total:.2f}s"
+
+    def finish(self, outcome: str = None):
+        """Log the order's step timings and hand them to the observers"""
+        self._finished = time.perf_counter()
+        self.outcome = outcome
+        logger.info(f"Step timings {self.summary()}")
+        for observer in self.observers:
+            try:
+                observer(self)
+            except Exception as e:
+                logger.warning(f"Step timer observer failed: {e}")
+
+
+def parse_result_payload(payload) -> Optional[Dict]:
+    """
+    Transaction result from the payment submission's JSON body.
+
+    Returns {'status': 'success' | 'failed', 'message', 'transaction_id'},
+    or None when the payload does not say either way.
+    """
+    if not isinstance(payload, dict):
+        return None
+    data = payload.get('data') if isinstance(payload.get('data'), dict) else {}
+    fields = {**data, **payload}
+    status = str(fields.get('status') or fields.get('result') or '').lower()
+    message = str(fields.get('message') or fields.get('msg') or fields.get('error') or '')
+    transaction_id = fields.get('transaction_id') or fields.get('txn_id') or fields.get('order_id')
+
+    if status in SUCCESS_STATUSES or fields.get('success') is True:
+        return {'status': 'success', 'message': message, 'transaction_id': transaction_id}
+    if status in FAILURE_STATUSES or fields.get('error') or fields.get('success') is False:
+        return {'status': 'failed', 'message': message or status or 'Error', 'transaction_id': None}
+    return None
+
+
+class ResultWatcher:
+    """
+    Detects the transaction result as soon as the shop answers the CONFIRM.
+
+    Enter it before clicking CONFIRM so the payment submission's response
+    (URL containing PAYMENT_RESPONSE_PATTERN) cannot be missed:
+
+        async with ResultWatcher(page) as watcher:
+            await confirm.click()
+            result = await watcher.result()
+
+    The result is read from the response body. When the response is not
+    recognised, or the page shows a result first, the page is read with a
+    single evaluate() instead of scanning it element by element. Results are
+    dicts with 'status' ('success', 'failed' or 'unknown'), 'message',
+    'transaction_id' and 'source' ('response' or 'page').
+    """
+
+    def __init__(self, page: Page, timeout: float = 10000, response_pattern: str = None):
+        self.page = page
+        self.timeout = timeout
+        self.response_pattern = response_pattern or os.environ.get('PAYMENT_RESPONSE_PATTERN', '/api/payment')
+        self._left_page: Optional[Callable[[str], bool]] = None
+        self._response: Optional[asyncio.Future] = None
+
+    def _is_payment_response(self, response) -> bool:
+        return response.request.method == 'POST' and self.response_pattern in response.url
+
+    async def __aenter__(self) -> 'ResultWatcher':
+        self._left_page = url_changed_from(self.page)
+        self._response = asyncio.ensure_future(
+            self.page.wait_for_event('response', predicate=self._is_payment_response, timeout=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        if not self._response.done():
+            self._response.cancel()
+        await asyncio.gather(self._response, return_exceptions=True)
+
+    async def result(self) -> Dict:
+        """Wait for the payment response or a result on the page, whichever comes first"""
+        page_ready = asyncio.ensure_future(wait_until_ready(
+            self.page, selector=RESULT_TEXT, url=self._left_page, timeout=self.timeout, step='result'
+        ))
+        pending = {self._response, page_ready}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if self._response in done:
+                    result = await self._from_response()
+                    if result:
+                        return result
+                if page_ready in done:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return await self._from_page()
+
+    async def recheck(self) -> Dict:
+        """Read the page again after an unclear result; never touches the form"""
+        await wait_until_ready(self.page, selector=RESULT_TEXT, timeout=self.timeout, step='result_recheck')
+        return await self._from_page()
+
+    async def _from_response(self) -> Optional[Dict]:
+        if self._response.cancelled() or self._response.exception() is not None:
+            TIMEOUTS.inc(kind='result_response', step='result')
+            return None
+        response = self._response.result()
+        try:
+            result = parse_result_payload(await response.json())
+        except Exception as e:
+            logger.warning(f"Unreadable payment response from {response.url}: {e}")
+            return None
+        if result is None:
+            logger.warning(f"Unrecognised payment response from {response.url} (HTTP {response.status})")
+            return None
+        result['source'] = 'response'
+        return result
+
+    async def _from_page(self) -> Dict:
+        found = await self.page.evaluate(READ_RESULT_JS)
+        url = found['url'].lower()
+        if found['success'] or (not found['failure'] and 'success' in url):
+            status, message = 'success', found['success'] or ''
+        elif found['failure'] or 'error' in url:
+            status, message = 'failed', found['failure'] or 'Error'
+        else:
+            status, message = 'unknown', ''
+        return {'status': status, 'message': message, 'transaction_id': found['transaction_id'], 'source': 'page'}
@@ -0,0 +1,126 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+import httpx
+from http_engine import HttpEngine
+
+logger = logging.getLogger(__name__)
+
+
+class Player(NamedTuple):
+    """A UID as the shop knows it; `nickname` is None for a UID the shop rejected"""
+    uid: str
+    nickname: Optional[str]
+
+    @property
+    def valid(self) -> bool:
+        return self.nickname is not None
+
+
+class PlayerLookup:
+    """
+    Resolves UIDs to player nicknames through the shop's player login call.
+
+    Answers are kept in an LRU cache of at most `max_entries`
+    (PLAYER_CACHE_MAX). Known players are kept for `ttl` seconds
+    (PLAYER_CACHE_TTL) and rejected UIDs for the shorter `miss_ttl`
+    (PLAYER_CACHE_MISS_TTL). Concurrent lookups of one UID share a single
+    request. A lookup that cannot reach the shop within `timeout` seconds
+    (PLAYER_LOOKUP_TIMEOUT) returns None and is not cached, so an outage
+    never blocks ordering.
+
+    A UID is only rejected on the shop's explicit "player not found" answer
+    described by `api.player_not_found` in flow.json: an `error` code from
+    its `errors`, sent with HTTP 200 or one of its `status` codes. Any other
+    answer (a wrong path, rate limiting, a block page) means "could not
+    check" and returns None. PLAYER_LOOKUP=off disables lookups entirely.
+    """
+
+    def __init__(self, http_engine: HttpEngine, ttl: float = None, miss_ttl: float = None, max_entries: int = None,
+                 timeout: float = None, enabled: bool = None):
+        self.http_engine = http_engine
+        self.enabled = enabled if enabled is not None else os.environ.get('PLAYER_LOOKUP', 'on').lower() != 'off'
+        self.ttl = float(ttl if ttl is not None else os.environ.get('PLAYER_CACHE_TTL', 3600))
+        self.miss_ttl = float(miss_ttl if miss_ttl is not None else os.environ.get('PLAYER_CACHE_MISS_TTL', 300))
+        self.max_entries = int(max_entries if max_entries is not None else os.environ.get('PLAYER_CACHE_MAX', 1000))
+        self.timeout = float(timeout if timeout is not None else os.environ.get('PLAYER_LOOKUP_TIMEOUT', 5))
+        self.cache: 'OrderedDict[str, Tuple[Player, float]]' = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def resolve(self, uid: str) -> Optional[Player]:
+        """The player for `uid`, or None when the shop could not be asked"""
+        if not self.enabled:
+            return None
+        cached = self.cache.get(uid)
+        if cached is not None:
+            player, expires = cached
+            if time.monotonic() < expires:
+                self.cache.move_to_end(uid)
+                self.hits += 1
+                return player
+            del self.cache[uid]
+
+        self.misses += 1
+        pending = self._pending.get(uid)
+        if pending is None:
+            pending = asyncio.ensure_future(self._fetch(uid))
+            self._pending[uid] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(uid, None))
+        player = await asyncio.shield(pending)
+        if player is not None:
+            self._store(player)
+        return player
+
+    def _store(self, player: Player):
+        ttl = self.ttl if player.valid else self.miss_ttl
+        self.cache[player.uid] = (player, time.monotonic() + ttl)
+        self.cache.move_to_end(player.uid)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+    async def _fetch(self, uid: str) -> Optional[Player]:
+        api = self.http_engine.loader.current().api
+        if not api:
+            return None
+        try:
+            response = await asyncio.wait_for(
+                self.http_engine.player_login(self.http_engine.client(), api, uid), self.timeout
+            )
+            data = response.json()
+        except (httpx.HTTPError, ValueError, asyncio.TimeoutError) as e:
+            self.errors += 1
+            logger.warning(f"Player lookup for UID {uid} failed: {e!r}")
+            return None
+        if response.status_code == 200 and isinstance(data, dict) and not data.get('error'):
+            return Player(uid, str(data.get('nickname') or uid))
+        if self._not_found(api, response.status_code, data):
+            return Player(uid, None)
+        self.errors += 1
+        logger.warning(f"Player lookup for UID {uid} failed: HTTP {response.status_code}")
+        return None
+
+    @staticmethod
+    def _not_found(api: Dict, status: int, data) -> bool:
+        """True only for the shop's configured "player not found" answer"""
+        not_found = api.get('player_not_found')
+        if not not_found or not isinstance(data, dict) or not data.get('error'):
+            return False
+        if status != 200 and status not in not_found.get('status', []):
+            return False
+        return str(data['error']) in not_found.get('errors', [])
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'cached': len(self.cache),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors
+        }
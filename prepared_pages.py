@@ -0,0 +1,125 @@
+import os
+import asyncio
+import logging
+from typing import AsyncContextManager, Callable, Dict, Optional
+from playwright.async_api import Page
+
+logger = logging.getLogger(__name__)
+
+
+class PreparedPage:
+    """A page speculatively driven to the payment screen for one user's UID"""
+
+    def __init__(self, key, uid: str):
+        self.key = key
+        self.uid = uid
+        self.page: Optional[Page] = None
+        # True once the page is at the payment screen, False if preparing failed
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.claimed = False
+        # Set once the claiming order is done with the page
+        self.finished = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class PreparedPages:
+    """
+    Pages prepared in the background while the user is still typing.
+
+    `prepare(uid)` is an async context manager that leases a browser context,
+    drives it through navigation, game selection and player login, and yields
+    the page (or None on failure); the context is closed when it exits. A
+    prepared page is held until its order is done with it, until it is
+    released (/cancel, a new /tp, a refused order) or until `ttl` seconds
+    (PREPARED_PAGE_TTL) pass unclaimed. At most `max_pages`
+    (PREPARED_PAGES_MAX) are held at once so speculation cannot crowd out
+    running orders.
+    """
+
+    def __init__(self, prepare: Callable[[str], AsyncContextManager[Optional[Page]]], max_pages: int = None,
+                 ttl: float = None):
+        self.prepare = prepare
+        self.max_pages = int(max_pages if max_pages is not None else os.environ.get('PREPARED_PAGES_MAX', 2))
+        self.ttl = float(ttl if ttl is not None else os.environ.get('PREPARED_PAGE_TTL', 300))
+        self.pages: Dict[object, PreparedPage] = {}
+        self.hits = 0
+        self.expired = 0
+
+    def start(self, key, uid: str):
+        """Start preparing a page for `uid`, replacing an unclaimed one for the same key"""
+        self.release(key)
+        if key in self.pages or len(self.pages) >= self.max_pages:
+            logger.info(f"Not preparing a page for UID {uid}: {len(self.pages)} already held")
+            return
+        prepared = PreparedPage(key, uid)
+        prepared.task = asyncio.create_task(self._hold(prepared), name=f"prepare-{uid}")
+        self.pages[key] = prepared
+
+    async def _hold(self, prepared: PreparedPage):
+        try:
+            async with self.prepare(prepared.uid) as page:
+                prepared.page = page
+                prepared.ready.set_result(page is not None)
+                if page is None:
+                    return
+                try:
+                    await asyncio.wait_for(prepared.finished.wait(), self.ttl)
+                except asyncio.TimeoutError:
+                    if not prepared.claimed:
+                        self.expired += 1
+                        logger.info(f"Prepared page for UID {prepared.uid} expired unused")
+                        return
+                    # Never close the page under a running order
+                    await prepared.finished.wait()
+        except Exception as e:
+            logger.warning(f"Preparing a page for UID {prepared.uid} failed: {e}")
+        finally:
+            if not prepared.ready.done():
+                prepared.ready.set_result(False)
+            if self.pages.get(prepared.key) is prepared:
+                del self.pages[prepared.key]
+
+    async def claim(self, key, uid: str) -> Optional[PreparedPage]:
+        """Take the page prepared for this key and UID, waiting for it to be ready"""
+        prepared = self.pages.get(key)
+        if prepared is None or prepared.uid != uid or prepared.claimed:
+            return None
+        prepared.claimed = True
+        if not await asyncio.shield(prepared.ready):
+            return None
+        self.hits += 1
+        return prepared
+
+    def done(self, prepared: PreparedPage):
+        """The claiming order is finished with the page; close it"""
+        prepared.finished.set()
+
+    def release(self, key):
+        """Drop an unclaimed prepared page (conversation cancelled or restarted)"""
+        prepared = self.pages.get(key)
+        if prepared is None or prepared.claimed:
+            return
+        del self.pages[key]
+        prepared.task.cancel()
+
+    async def shed(self) -> int:
+        """Drop every unclaimed prepared page to free memory; returns how many were dropped"""
+        keys = [key for key, prepared in self.pages.items() if not prepared.claimed]
+        for key in keys:
+            self.release(key)
+        return len(keys)
+
+    async def stop(self):
+        tasks = [prepared.task for prepared in self.pages.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.pages.clear()
+
+    def stats(self) -> Dict:
+        return {
+            'held': len(self.pages),
+            'max_pages': self.max_pages,
+            'hits': self.hits,
+            'expired': self.expired
+        }
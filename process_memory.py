@@ -0,0 +1,184 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+MB = 1024 * 1024
+
+
+def _children() -> Dict[int, List[int]]:
+    """Parent pid -> child pids of every process (Linux /proc)"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                # The command name may contain spaces; fields resume after the last ')'
+                fields = stat.read().rsplit(')', 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        except (OSError, IndexError):
+            continue
+    return children
+
+
+def _descendants(root_pid: int, children: Dict[int, List[int]]) -> List[int]:
+    """`root_pid` and every process below it"""
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def process_rss(pid: int) -> int:
+    """Resident bytes of one process; 0 once it has exited"""
+    try:
+        with open(f'/proc/{pid}/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def process_tree_rss(root_pid: int) -> int:
+    """Resident bytes of a process and all its descendants (Linux /proc)"""
+    return sum(process_rss(pid) for pid in _descendants(root_pid, _children()))
+
+
+def browser_pids(root_pid: int) -> Set[int]:
+    """Chromium browser processes below `root_pid`, as launched by Playwright"""
+    found = set()
+    for pid in _descendants(root_pid, _children()):
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as cmdline:
+                args = cmdline.read().split(b'\0')
+        except OSError:
+            continue
+        # Only the browser process itself is driven over the pipe; renderers and the GPU process are not
+        if b'--remote-debugging-pipe' in args:
+            found.add(pid)
+    return found
+
+
+class MemorySample(NamedTuple):
+    """One RSS reading of the bot's process tree, in bytes"""
+    taken_at: float
+    bot: int
+    # Everything else below the bot: the Playwright driver and Chromium
+    children: int
+    # Browser process pid -> RSS of that browser and its renderers
+    browsers: Dict[int, int]
+
+    @property
+    def total(self) -> int:
+        return self.bot + self.children
+
+
+def sample_memory(root_pid: int, browsers: Set[int] = ()) -> MemorySample:
+    """RSS of `root_pid`, of its descendants and of the tree under each pid in `browsers`"""
+    children = _children()
+    bot = process_rss(root_pid)
+    tree = sum(process_rss(pid) for pid in _descendants(root_pid, children)[1:])
+    per_browser = {pid: sum(process_rss(child) for child in _descendants(pid, children)) for pid in browsers}
+    return MemorySample(time.monotonic(), bot, tree, per_browser)
+
+
+class MemoryMonitor:
+    """
+    Samples the RSS of the bot process and every Chromium child.
+
+    A sample is taken every `interval` seconds (MEMORY_SAMPLE_INTERVAL)
+    and handed to the async `observers`, which is how BrowserPool enforces
+    its memory budget and per-browser ceiling. `browsers` holds the
+    browser pids to break the Chromium total down by. Without /proc (not
+    Linux) the monitor stays disabled and every reading is None.
+    """
+
+    def __init__(self, interval: float = None):
+        self.interval = float(interval if interval is not None else os.environ.get('MEMORY_SAMPLE_INTERVAL', 5))
+        self.enabled = os.path.isdir('/proc')
+        self.pid = os.getpid()
+        self.browsers: Set[int] = set()
+        self.observers: List[Callable[[MemorySample], Awaitable[None]]] = []
+        self.latest: Optional[MemorySample] = None
+        self.peak = 0
+        self._sampler: Optional[asyncio.Task] = None
+
+    async def sample(self) -> Optional[MemorySample]:
+        """Take a sample now and hand it to the observers"""
+        if not self.enabled:
+            return None
+        sample = await asyncio.to_thread(sample_memory, self.pid, set(self.browsers))
+        self.latest = sample
+        self.peak = max(self.peak, sample.total)
+        for observer in self.observers:
+            try:
+                await observer(sample)
+            except Exception as e:
+                logger.error(f"Memory observer failed: {e}")
+        return sample
+
+    async def current(self) -> Optional[MemorySample]:
+        """The latest sample, refreshed first when it is older than the sampling interval"""
+        if self.latest is None or time.monotonic() - self.latest.taken_at >= self.interval:
+            return await self.sample()
+        return self.latest
+
+    async def start(self):
+        if self.enabled and self.interval > 0 and self._sampler is None:
+            self._sampler = asyncio.create_task(self._sample_periodically())
+
+    async def _sample_periodically(self):
+        while True:
+            await self.sample()
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._sampler is not None:
+            self._sampler.cancel()
+            await asyncio.gather(self._sampler, return_exceptions=True)
+            self._sampler = None
+
+    def stats(self) -> Dict:
+        sample = self.latest
+        if sample is None:
+            return {'enabled': self.enabled}
+        return {
+            'enabled': self.enabled,
+            'bot_mb': round(sample.bot / MB),
+            'chromium_mb': round(sample.children / MB),
+            'total_mb': round(sample.total / MB),
+            'peak_mb': round(self.peak / MB),
+            'browsers_mb': [round(rss / MB) for rss in sample.browsers.values()],
+            'age_seconds': round(time.monotonic() - sample.taken_at)
+        }
+
+
+class RssSampler:
+    """Samples the process tree RSS in a background thread and keeps the peak"""
+
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if os.path.isdir('/proc'):
+                self.peak = max(self.peak, process_tree_rss(os.getpid()))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
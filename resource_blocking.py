@@ -0,0 +1,140 @@
+import os
+import logging
+from collections import Counter
+from typing import Dict, List
+from urllib.parse import urlparse
+from playwright.async_api import BrowserContext, Route, Request, Response
+
+logger = logging.getLogger(__name__)
+
+# Resource types the flow never looks at
+DEFAULT_BLOCKED_TYPES = ['image', 'media', 'font']
+
+# Third-party analytics, ads and tracking pixels loaded by the shop page
+DEFAULT_BLOCKED_DOMAINS = [
+    'google-analytics.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+    'googlesyndication.com',
+    'facebook.net',
+    'facebook.com',
+    'connect.facebook.net',
+    'hotjar.com',
+    'clarity.ms',
+    'tiktok.com',
+    'appsflyer.com',
+    'branch.io',
+    'sentry.io'
+]
+
+# URL fragments the flow needs even if their type is blocked (e.g. the Free Fire game tile)
+DEFAULT_ALLOWED_PATTERNS = ['freefire', 'free-fire', 'free_fire']
+
+# Typical transfer sizes used to estimate savings until real sizes are observed
+DEFAULT_TYPE_SIZES = {
+    'image': 30_000,
+    'media': 250_000,
+    'font': 40_000,
+    'script': 60_000,
+    'stylesheet': 20_000,
+    'xhr': 2_000,
+    'fetch': 2_000,
+    'other': 5_000
+}
+
+
+def _env_list(name: str, default: List[str]) -> List[str]:
+    value = os.environ.get(name)
+    if value is None:
+        return list(default)
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class BlockStats:
+    """Per-order counters of blocked requests and the bytes they would have cost"""
+
+    def __init__(self, type_sizes: Dict[str, int]):
+        self.type_sizes = type_sizes
+        self.blocked = Counter()
+        self.allowed = 0
+        self.bytes_loaded = 0
+        self.estimated_bytes_saved = 0
+
+    def record_block(self, resource_type: str):
+        self.blocked[resource_type] += 1
+        self.estimated_bytes_saved += self.type_sizes.get(resource_type, self.type_sizes['other'])
+
+    def summary(self) -> str:
+        blocked = ", ".join(f"{kind}={count}" for kind, count in self.blocked.most_common()) or "none"
+        return (
+            f"blocked {sum(self.blocked.values())} requests ({blocked}), "
+            f"~{self.estimated_bytes_saved / 1024:.0f} KB saved, {self.bytes_loaded / 1024:.0f} KB loaded"
+        )
+
+
+class RequestBlocker:
+    """
+    Route-interception profile for shop browser contexts.
+
+    Aborts requests of blocked resource types and any request to a blocked
+    third-party domain, except URLs matching the allowlist. Savings are
+    estimated from the average size of each resource type actually loaded.
+    """
+
+    def __init__(self, blocked_types: List[str] = None, blocked_domains: List[str] = None,
+                 allowed_patterns: List[str] = None, enabled: bool = None):
+        self.enabled = enabled if enabled is not None else os.environ.get('RESOURCE_BLOCKING', '1') != '0'
+        self.blocked_types = set(blocked_types or _env_list('BLOCK_RESOURCE_TYPES', DEFAULT_BLOCKED_TYPES))
+        self.blocked_domains = blocked_domains or (
+            DEFAULT_BLOCKED_DOMAINS + _env_list('BLOCK_EXTRA_DOMAINS', [])
+        )
+        self.allowed_patterns = [
+            pattern.lower() for pattern in
+            (allowed_patterns or DEFAULT_ALLOWED_PATTERNS + _env_list('BLOCK_ALLOW_PATTERNS', []))
+        ]
+        # Running average response size per resource type
+        self._size_totals = Counter(DEFAULT_TYPE_SIZES)
+        self._size_counts = Counter({kind: 1 for kind in DEFAULT_TYPE_SIZES})
+
+    def is_allowed(self, url: str) -> bool:
+        url = url.lower()
+        return any(pattern in url for pattern in self.allowed_patterns)
+
+    def is_blocked_domain(self, url: str) -> bool:
+        host = urlparse(url).hostname or ''
+        return any(host == domain or host.endswith('.' + domain) for domain in self.blocked_domains)
+
+    def should_block(self, request: Request) -> bool:
+        if self.is_allowed(request.url):
+            return False
+        return request.resource_type in self.blocked_types or self.is_blocked_domain(request.url)
+
+    def type_sizes(self) -> Dict[str, int]:
+        return {kind: self._size_totals[kind] // self._size_counts[kind] for kind in self._size_counts}
+
+    async def attach(self, context: BrowserContext, label: str = 'order') -> BlockStats:
+        """Install the profile on a context; the summary is logged when it closes"""
+        stats = BlockStats(self.type_sizes())
+        if not self.enabled:
+            return stats
+
+        async def handle(route: Route, request: Request):
+            if self.should_block(request):
+                stats.record_block(request.resource_type)
+                await route.abort()
+            else:
+                stats.allowed += 1
+                await route.continue_()
+
+        def on_response(response: Response):
+            length = response.headers.get('content-length')
+            if length and length.isdigit():
+                kind = response.request.resource_type
+                stats.bytes_loaded += int(length)
+                self._size_totals[kind] += int(length)
+                self._size_counts[kind] += 1
+
+        await context.route("**/*", handle)
+        context.on("response", on_response)
+        context.on("close", lambda _: logger.info(f"Request blocking for {label}: {stats.summary()}"))
+        return stats
@@ -0,0 +1,129 @@
+import os
+import time
+import sqlite3
+import logging
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SelectorStat:
+    """Hit/attempt counters and match latency for one candidate selector"""
+
+    def __init__(self, attempts: int = 0, hits: int = 0, total_latency_ms: float = 0.0, last_hit_at: float = 0.0):
+        self.attempts = attempts
+        self.hits = hits
+        self.total_latency_ms = total_latency_ms
+        self.last_hit_at = last_hit_at
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.attempts if self.attempts else 0.0
+
+    @property
+    def avg_latency_ms(self) -> float:
+        return self.total_latency_ms / self.hits if self.hits else 0.0
+
+
+class SelectorScoreboard:
+    """
+    Persistent per-step scoreboard of which candidate selectors match.
+
+    Stats live in memory for ranking and are written to a small SQLite file
+    by flush(), so the ranking survives restarts and Garena redeploys are
+    picked up from production traffic. Candidates that keep losing after
+    min_attempts races are pruned from the first race of a step.
+    """
+
+    def __init__(self, path: str = None, min_attempts: int = None, prune_below: float = None):
+        self.path = path or os.environ.get('SELECTOR_STATS_DB', 'selector_stats.db')
+        self.min_attempts = int(min_attempts if min_attempts is not None else os.environ.get('SELECTOR_PRUNE_MIN_ATTEMPTS', 20))
+        self.prune_below = float(prune_below if prune_below is not None else os.environ.get('SELECTOR_PRUNE_BELOW', 0.02))
+        self.stats: Dict[Tuple[str, str], SelectorStat] = {}
+        self._dirty = set()
+
+        self._db = sqlite3.connect(self.path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS selector_stats ("
+            "step TEXT NOT NULL, selector TEXT NOT NULL, attempts INTEGER NOT NULL, hits INTEGER NOT NULL, "
+            "total_latency_ms REAL NOT NULL, last_hit_at REAL NOT NULL, PRIMARY KEY (step, selector))"
+        )
+        self._db.commit()
+        for step, selector, attempts, hits, total_latency_ms, last_hit_at in self._db.execute(
+                "SELECT step, selector, attempts, hits, total_latency_ms, last_hit_at FROM selector_stats"):
+            self.stats[(step, selector)] = SelectorStat(attempts, hits, total_latency_ms, last_hit_at)
+
+    def _stat(self, step: str, selector: str) -> SelectorStat:
+        key = (step, selector)
+        if key not in self.stats:
+            self.stats[key] = SelectorStat()
+        self._dirty.add(key)
+        return self.stats[key]
+
+    def record_race(self, step: str, selectors: List[str], winner: str = None, latency_ms: float = 0.0):
+        """Count one race for every raced candidate and a hit for the winner"""
+        for selector in selectors:
+            self._stat(step, selector).attempts += 1
+        if winner is not None:
+            stat = self._stat(step, winner)
+            stat.hits += 1
+            stat.total_latency_ms += latency_ms
+            stat.last_hit_at = time.time()
+
+    def ranked(self, step: str, selectors: List[str]) -> List[str]:
+        """Candidates by hit rate, then match latency; unseen ones keep their order"""
+        def score(selector):
+            stat = self.stats.get((step, selector), SelectorStat())
+            return (-stat.hit_rate, stat.avg_latency_ms if stat.hits else float('inf'))
+        return sorted(selectors, key=score)
+
+    def split(self, step: str, selectors: List[str]) -> Tuple[List[str], List[str]]:
+        """Ranked candidates split into (active, pruned); never prunes them all"""
+        active, pruned = [], []
+        for selector in self.ranked(step, selectors):
+            stat = self.stats.get((step, selector))
+            if stat and stat.attempts >= self.min_attempts and stat.hit_rate < self.prune_below:
+                pruned.append(selector)
+            else:
+                active.append(selector)
+        if not active:
+            return pruned, []
+        return active, pruned
+
+    def flush(self):
+        """Write changed stats to disk in one transaction"""
+        if not self._dirty:
+            return
+        rows = []
+        for step, selector in self._dirty:
+            stat = self.stats[(step, selector)]
+            rows.append((step, selector, stat.attempts, stat.hits, stat.total_latency_ms, stat.last_hit_at))
+        try:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO selector_stats "
+                "(step, selector, attempts, hits, total_latency_ms, last_hit_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._db.commit()
+            self._dirty.clear()
+        except sqlite3.Error as e:
+            logger.error(f"Could not save selector stats: {e}")
+
+    def report(self) -> str:
+        """Plain-text ranking of every step's candidates"""
+        steps = sorted({step for step, _ in self.stats})
+        if not steps:
+            return "No selector stats recorded yet."
+        lines = []
+        for step in steps:
+            selectors = [selector for s, selector in self.stats if s == step]
+            active, pruned = self.split(step, selectors)
+            lines.append(f"[{step}]")
+            for rank, selector in enumerate(active + pruned, 1):
+                stat = self.stats[(step, selector)]
+                flag = " (pruned)" if selector in pruned else ""
+                lines.append(
+                    f"{rank}. {stat.hits}/{stat.attempts} hits ({stat.hit_rate:.0%}), "
+                    f"{stat.avg_latency_ms:.0f}ms avg{flag}\n   {selector}"
+                )
+        return "\n".join(lines)
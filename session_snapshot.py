@@ -0,0 +1,66 @@
+import os
+import time
+import logging
+from typing import Dict, Optional
+from playwright.async_api import BrowserContext, Page
+
+logger = logging.getLogger(__name__)
+
+
+class SessionSnapshot:
+    """
+    Warmed storage state of a context positioned at the Free Fire login screen.
+
+    The landing page and game selection are the same for every order, so the
+    first order that gets through them captures the context's cookies and
+    localStorage together with the login page URL. Later contexts start from
+    that state and deep-link straight to the login page. The snapshot expires
+    after `ttl` seconds (SESSION_SNAPSHOT_TTL, 0 disables it) and is dropped
+    as soon as a deep link does not land on the login screen, or a later step
+    fails on a page that started from it.
+    """
+
+    def __init__(self, ttl: float = None):
+        self.ttl = float(ttl if ttl is not None else os.environ.get('SESSION_SNAPSHOT_TTL', 600))
+        self.state: Optional[Dict] = None
+        self.login_url: Optional[str] = None
+        self.captured_at = 0.0
+        self.hits = 0
+        self.invalidations = 0
+
+    @property
+    def fresh(self) -> bool:
+        return self.state is not None and time.monotonic() - self.captured_at < self.ttl
+
+    def context_options(self) -> Dict:
+        """Extra browser context options that start a context from the snapshot"""
+        return {'storage_state': self.state} if self.fresh else {}
+
+    async def capture(self, context: BrowserContext, page: Page):
+        """Remember the state of a context that has just reached the login screen"""
+        if self.ttl <= 0 or self.fresh:
+            return
+        try:
+            self.state = await context.storage_state()
+        except Exception as e:
+            logger.warning(f"Could not capture session snapshot: {e}")
+            return
+        self.login_url = page.url
+        self.captured_at = time.monotonic()
+        logger.info(f"Captured session snapshot at {self.login_url}")
+
+    def invalidate(self, reason: str):
+        if self.state is None:
+            return
+        self.state = None
+        self.login_url = None
+        self.invalidations += 1
+        logger.warning(f"Session snapshot invalidated: {reason}")
+
+    def stats(self) -> Dict:
+        return {
+            'fresh': self.fresh,
+            'login_url': self.login_url,
+            'hits': self.hits,
+            'invalidations': self.invalidations
+        }
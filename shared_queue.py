@@ -0,0 +1,186 @@
+import os
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Order states in the shared queue
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+
+
+class SharedQueue:
+    """
+    SQLite-backed order queue shared by the front end and worker processes.
+
+    The front end enqueues orders and collects finished ones; workers
+    claim orders, report heartbeats and store results. SQLite in WAL mode
+    makes a claim atomic across processes. Every process that reaps
+    checks for workers whose heartbeat is older than `dead_after` seconds
+    (WORKER_DEAD_AFTER). Their orders that never reached CONFIRM go back
+    to the queue. Orders already past CONFIRM are finished with an
+    "interrupted" result instead, since running them again could spend the
+    voucher twice.
+
+    The database (SHARED_QUEUE_DB) must be on a disk every process can
+    reach. A PIN is kept only until its order is finished.
+    """
+
+    def __init__(self, path: str = None, dead_after: float = None):
+        self.path = path or os.environ.get('SHARED_QUEUE_DB', 'shared_queue.db')
+        self.dead_after = float(dead_after if dead_after is not None else os.environ.get('WORKER_DEAD_AFTER', 30))
+        # Calls come from worker threads (asyncio.to_thread); one connection, one at a time
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS orders ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, serial TEXT NOT NULL, uid TEXT NOT NULL, amount TEXT NOT NULL, "
+            "pin TEXT, user_id INTEGER, chat_id INTEGER, engine TEXT, state TEXT NOT NULL, worker TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, past_confirm INTEGER NOT NULL DEFAULT 0, result TEXT, "
+            "delivered INTEGER NOT NULL DEFAULT 0, enqueued_at REAL NOT NULL, claimed_at REAL, finished_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS orders_state ON orders (state, id)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS workers ("
+            "id TEXT PRIMARY KEY, host TEXT NOT NULL, pid INTEGER NOT NULL, slots INTEGER NOT NULL, "
+            "running INTEGER NOT NULL, started_at REAL NOT NULL, heartbeat_at REAL NOT NULL)"
+        )
+
+    def _transaction(self, statements):
+        """Run `statements(db)` in one write transaction and return its result"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self._db)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    def enqueue(self, serial: str, uid: str, amount: str, pin: str, user_id: int = None, chat_id: int = None,
+                engine: str = None) -> int:
+        """Add an order and return its id"""
+        return self._transaction(lambda db: db.execute(
+            "INSERT INTO orders (serial, uid, amount, pin, user_id, chat_id, engine, state, enqueued_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (serial, uid, amount, pin, user_id, chat_id, engine, QUEUED, time.time())
+        ).lastrowid)
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """Take the oldest queued order for `worker_id`, or None when there is none"""
+        def claim_oldest(db):
+            row = db.execute("SELECT * FROM orders WHERE state = ? ORDER BY id LIMIT 1", (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE orders SET state = ?, worker = ?, attempts = attempts + 1, claimed_at = ? WHERE id = ?",
+                (RUNNING, worker_id, time.time(), row['id'])
+            )
+            return dict(row)
+        return self._transaction(claim_oldest)
+
+    def mark_past_confirm(self, order_id: int):
+        """The worker is about to click CONFIRM; the order must never be run again"""
+        self._transaction(lambda db: db.execute("UPDATE orders SET past_confirm = 1 WHERE id = ?", (order_id,)))
+
+    def clear_past_confirm(self, order_id: int):
+        """The CONFIRM submission never left the worker; the order may run again"""
+        self._transaction(lambda db: db.execute("UPDATE orders SET past_confirm = 0 WHERE id = ?", (order_id,)))
+
+    def finish(self, order_id: int, result: str):
+        """Store an order's result and forget its PIN"""
+        self._transaction(lambda db: db.execute(
+            "UPDATE orders SET state = ?, result = ?, pin = NULL, finished_at = ? WHERE id = ?",
+            (DONE, result, time.time(), order_id)
+        ))
+
+    def release(self, order_id: int):
+        """Put an order a stopping worker did not finish back in the queue, unless it got past CONFIRM"""
+        self._transaction(lambda db: db.execute(
+            "UPDATE orders SET state = ?, worker = NULL WHERE id = ? AND state = ? AND past_confirm = 0",
+            (QUEUED, order_id, RUNNING)
+        ))
+
+    def heartbeat(self, worker_id: str, slots: int, running: int):
+        now = time.time()
+        self._transaction(lambda db: db.execute(
+            "INSERT INTO workers (id, host, pid, slots, running, started_at, heartbeat_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET slots = excluded.slots, running = excluded.running, "
+            "heartbeat_at = excluded.heartbeat_at",
+            (worker_id, socket.gethostname(), os.getpid(), slots, running, now, now)
+        ))
+
+    def unregister(self, worker_id: str):
+        self._transaction(lambda db: db.execute("DELETE FROM workers WHERE id = ?", (worker_id,)))
+
+    def reap(self, interrupted_result: str) -> int:
+        """Reassign the orders of workers that stopped heartbeating; returns how many were affected"""
+        def reap_dead(db):
+            deadline = time.time() - self.dead_after
+            dead = [row['id'] for row in db.execute("SELECT id FROM workers WHERE heartbeat_at < ?", (deadline,))]
+            # Orders whose worker is gone without ever registering a heartbeat count too
+            orphaned = db.execute(
+                "SELECT id, serial, worker, past_confirm FROM orders WHERE state = ? AND claimed_at < ? "
+                "AND (worker IS NULL OR worker NOT IN (SELECT id FROM workers WHERE heartbeat_at >= ?))",
+                (RUNNING, deadline, deadline)
+            ).fetchall()
+            for row in orphaned:
+                if row['past_confirm']:
+                    logger.warning(f"Worker {row['worker']} died after CONFIRM on order {row['serial']}")
+                    db.execute(
+                        "UPDATE orders SET state = ?, result = ?, pin = NULL, finished_at = ? WHERE id = ?",
+                        (DONE, interrupted_result, time.time(), row['id'])
+                    )
+                else:
+                    logger.warning(f"Worker {row['worker']} died, requeueing order {row['serial']}")
+                    db.execute("UPDATE orders SET state = ?, worker = NULL WHERE id = ?", (QUEUED, row['id']))
+            if dead:
+                db.executemany("DELETE FROM workers WHERE id = ?", [(worker_id,) for worker_id in dead])
+            return len(orphaned)
+        return self._transaction(reap_dead)
+
+    def finished(self, limit: int = 100) -> List[Dict]:
+        """Finished orders whose result the front end has not delivered yet"""
+        with self._lock:
+            return [dict(row) for row in self._db.execute(
+                "SELECT id, serial, uid, amount, user_id, chat_id, past_confirm, result FROM orders "
+                "WHERE state = ? AND delivered = 0 ORDER BY id LIMIT ?", (DONE, limit)
+            )]
+
+    def mark_delivered(self, order_ids: List[int]):
+        self._transaction(lambda db: db.executemany(
+            "UPDATE orders SET delivered = 1 WHERE id = ?", [(order_id,) for order_id in order_ids]
+        ))
+
+    def active_serials(self) -> Set[str]:
+        """Serials of orders not yet delivered back to the front end"""
+        with self._lock:
+            return {row['serial'] for row in self._db.execute("SELECT serial FROM orders WHERE delivered = 0")}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            states = dict(self._db.execute(
+                "SELECT state, COUNT(*) FROM orders WHERE delivered = 0 GROUP BY state"
+            ).fetchall())
+            deadline = time.time() - self.dead_after
+            workers = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(slots), 0), COALESCE(SUM(running), 0) FROM workers "
+                "WHERE heartbeat_at >= ?", (deadline,)
+            ).fetchone()
+        return {
+            'queued': states.get(QUEUED, 0),
+            'running': states.get(RUNNING, 0),
+            'undelivered': states.get(DONE, 0),
+            'workers': workers[0],
+            'slots': workers[1],
+            'busy_slots': workers[2]
+        }
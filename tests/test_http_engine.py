@@ -0,0 +1,42 @@
+"""The HTTP fast path must not block a voucher whose payment request never left"""
+import asyncio
+import httpx
+from order_journal import QUEUED, RESULT
+from page_actions import StepTimer
+
+SERIAL = 'BDMB1S00001234'
+
+
+def refusing_payments(request: httpx.Request) -> httpx.Response:
+    """The shop answers login and denominations, but the payment connection is refused"""
+    if request.url.path == '/api/auth/player_id_login':
+        return httpx.Response(200, json={'uid': '1234567890', 'nickname': 'Tester'})
+    if request.url.path == '/api/denominations':
+        return httpx.Response(200, json={'denominations': [{'id': 'denom-25', 'amount': 25, 'label': '25 Diamond'}]})
+    raise httpx.ConnectError("Connection refused", request=request)
+
+
+def test_refused_payment_leaves_serial_submittable(tmp_path, monkeypatch):
+    monkeypatch.setenv('GARENA_SHOP_URL', 'http://shop.test')
+    monkeypatch.setenv('ORDER_JOURNAL_PATH', str(tmp_path / 'orders.jsonl'))
+    monkeypatch.setenv('SELECTOR_STATS_DB', ':memory:')
+    monkeypatch.delenv('ORDER_DISPATCH', raising=False)
+    from bot import FreeFireTopUpBot
+
+    async def scenario():
+        bot = FreeFireTopUpBot()
+        bot.http_engine.transport = httpx.MockTransport(refusing_payments)
+        await bot.order_journal.start()
+        try:
+            bot.order_journal.record(SERIAL, QUEUED, uid='1234567890', amount='25')
+            timer = StepTimer('test', engine='http', amount='25', voucher='BDMB')
+            # None: not confirmed, hand the order to the browser
+            assert await bot._http_top_up('1234567890', '25', SERIAL, '1234-5678-9012-3456', timer) is None
+            assert not bot.order_journal.orders[SERIAL]['past_confirm']
+            # The browser fallback failed too, before CONFIRM
+            bot.order_journal.record(SERIAL, RESULT, outcome='failed', rejected=False)
+            assert bot.order_journal.can_submit(SERIAL)
+        finally:
+            await bot.order_journal.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,141 @@
+"""
+Webhook mode end to end against a local fake Telegram Bot API.
+
+The bot is pointed at FakeBotApi through TELEGRAM_API_BASE_URL, started by
+the Quart app's before_serving hook, fed a /start update through POST
+/webhook and expected to answer with sendMessage.
+"""
+import sys
+import json
+import time
+import asyncio
+import importlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs
+
+TOKEN = '123456:TEST'
+SECRET = 'webhook-secret'
+CHAT_ID = 4242
+
+
+class FakeBotApi:
+    """Answers the Bot API methods the bot calls and records every call"""
+
+    def __init__(self):
+        self.calls: List[Dict] = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> 'FakeBotApi':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def methods(self) -> List[str]:
+        return [call['method'] for call in self.calls]
+
+    def answer(self, method: str, params: Dict):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Test', 'username': 'test_bot'}
+        if method == 'sendMessage':
+            return {
+                'message_id': len(self.calls),
+                'date': int(time.time()),
+                'chat': {'id': int(params['chat_id']), 'type': 'private'},
+                'text': params['text']
+            }
+        return True
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body or '{}')
+                else:
+                    params = {key: values[0] for key, values in parse_qs(body).items()}
+                method = self.path.rsplit('/', 1)[-1]
+                api.calls.append({'token': self.path.split('/')[1], 'method': method, 'params': params})
+                payload = json.dumps({'ok': True, 'result': api.answer(method, params)}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+def start_update(update_id: int) -> Dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': CHAT_ID, 'type': 'private'},
+            'from': {'id': CHAT_ID, 'is_bot': False, 'first_name': 'Tester'},
+            'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+        }
+    }
+
+
+def test_webhook_update_gets_a_reply(tmp_path, monkeypatch):
+    api = FakeBotApi().start()
+    monkeypatch.setenv('TELEGRAM_BOT_TOKEN', TOKEN)
+    monkeypatch.setenv('TELEGRAM_API_BASE_URL', f"{api.url}/bot")
+    monkeypatch.setenv('WEBHOOK_URL', 'https://bot.example.com')
+    monkeypatch.setenv('WEBHOOK_SECRET', SECRET)
+    # Nothing in this test needs a shop, a browser or state on disk
+    monkeypatch.setenv('GARENA_SHOP_URL', 'http://127.0.0.1:9')
+    monkeypatch.setenv('BROWSER_POOL_MIN_SIZE', '0')
+    monkeypatch.setenv('CATALOG_REFRESH_INTERVAL', '0')
+    monkeypatch.setenv('ORDER_JOURNAL_PATH', str(tmp_path / 'orders.jsonl'))
+    monkeypatch.setenv('SELECTOR_STATS_DB', ':memory:')
+    sys.modules.pop('app', None)
+    app_module = importlib.import_module('app')
+
+    async def scenario():
+        async with app_module.app.test_app() as test_app:
+            client = test_app.test_client()
+
+            forged = await client.post('/webhook', json=start_update(1))
+            assert forged.status_code == 403
+
+            response = await client.post(
+                '/webhook', json=start_update(2), headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}
+            )
+            assert response.status_code == 200
+
+            for _ in range(100):
+                if 'sendMessage' in api.methods():
+                    break
+                await asyncio.sleep(0.05)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        api.stop()
+        sys.modules.pop('app', None)
+
+    assert api.methods()[:1] == ['getMe']
+    set_webhook = next(call for call in api.calls if call['method'] == 'setWebhook')
+    assert set_webhook['params']['url'] == 'https://bot.example.com/webhook'
+    assert set_webhook['params']['secret_token'] == SECRET
+
+    replies = [call for call in api.calls if call['method'] == 'sendMessage']
+    assert len(replies) == 1
+    assert int(replies[0]['params']['chat_id']) == CHAT_ID
+    assert 'Welcome to Free Fire Top-Up Bot' in replies[0]['params']['text']
+    assert all(call['token'] == f"bot{TOKEN}" for call in api.calls)
@@ -0,0 +1,131 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+from typing import AsyncContextManager, Callable, Dict, Optional
+from playwright.async_api import BrowserContext, Page
+
+logger = logging.getLogger(__name__)
+
+
+class UidSession:
+    """A leased browser context with a page logged in as one player"""
+
+    def __init__(self, uid: str, context: BrowserContext, stack: AsyncExitStack):
+        self.uid = uid
+        self.context = context
+        self.page: Optional[Page] = None
+        # Payment screen to go back to before the next order
+        self.payment_url: Optional[str] = None
+        self.last_used = time.monotonic()
+        self.orders = 0
+        self._stack = stack
+
+    async def close(self):
+        try:
+            await self._stack.aclose()
+        except Exception as e:
+            logger.warning(f"Closing session for UID {self.uid} failed: {e}")
+
+
+class UidSessions:
+    """
+    Short-lived cache of pages logged in at the payment screen, keyed by UID.
+
+    After an order its session is kept so a follow-up order for the same
+    player within `ttl` seconds (UID_SESSION_TTL) goes straight to amount
+    selection. Sessions are evicted least recently used first and never more
+    than `max_sessions` (UID_SESSIONS_MAX) are held, since each one keeps a
+    browser context open. A session is taken out of the cache while an order
+    uses it, so two orders never share a page. `usable` (BrowserPool.usable)
+    keeps a session on a browser that is being recycled from being reused.
+    """
+
+    def __init__(self, ttl: float = None, max_sessions: int = None,
+                 usable: Callable[[BrowserContext], bool] = None):
+        self.ttl = float(ttl if ttl is not None else os.environ.get('UID_SESSION_TTL', 120))
+        self.max_sessions = int(max_sessions if max_sessions is not None else os.environ.get('UID_SESSIONS_MAX', 2))
+        self.usable = usable
+        self.sessions: 'OrderedDict[str, UidSession]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def open(self, uid: str, lease: AsyncContextManager[BrowserContext]) -> UidSession:
+        """Enter a browser pool lease and wrap it in a new session"""
+        stack = AsyncExitStack()
+        context = await stack.enter_async_context(lease)
+        return UidSession(uid, context, stack)
+
+    async def take(self, uid: str) -> Optional[UidSession]:
+        """Remove and return a fresh cached session for `uid`, if there is one"""
+        session = self.sessions.pop(uid, None)
+        if session is not None and time.monotonic() - session.last_used < self.ttl:
+            if self.usable is None or self.usable(session.context):
+                self.hits += 1
+                return session
+        if session is not None:
+            await session.close()
+        self.misses += 1
+        return None
+
+    async def keep(self, session: UidSession):
+        """Cache a session after an order, evicting the least recently used over the cap"""
+        if self.ttl <= 0 or self.max_sessions <= 0:
+            await session.close()
+            return
+        session.last_used = time.monotonic()
+        session.orders += 1
+        previous = self.sessions.pop(session.uid, None)
+        if previous is not None:
+            await previous.close()
+        self.sessions[session.uid] = session
+        while len(self.sessions) > self.max_sessions:
+            _, oldest = self.sessions.popitem(last=False)
+            self.evicted += 1
+            await oldest.close()
+
+    async def shed(self) -> int:
+        """Close every cached session to free memory; returns how many were closed"""
+        shed = 0
+        while self.sessions:
+            _, session = self.sessions.popitem(last=False)
+            self.evicted += 1
+            shed += 1
+            await session.close()
+        return shed
+
+    async def start(self):
+        """Start closing sessions that outlive the TTL"""
+        if self.ttl > 0:
+            self._sweeper = asyncio.create_task(self._sweep_periodically())
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(max(self.ttl / 2, 1))
+            now = time.monotonic()
+            for uid, session in list(self.sessions.items()):
+                if now - session.last_used >= self.ttl and self.sessions.get(uid) is session:
+                    del self.sessions[uid]
+                    await session.close()
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        while self.sessions:
+            _, session = self.sessions.popitem()
+            await session.close()
+
+    def stats(self) -> Dict:
+        return {
+            'held': len(self.sessions),
+            'max_sessions': self.max_sessions,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evicted': self.evicted
+        }
@@ -0,0 +1,144 @@
+"""
+Order worker for the sharded fleet.
+
+Run the front end with ORDER_DISPATCH=fleet and start any number of these
+next to it. Every process that can open SHARED_QUEUE_DB pulls orders from
+the shared queue:
+
+    ORDER_DISPATCH=fleet python app.py
+    ORDER_DISPATCH=fleet WORKER_SLOTS=2 python worker.py
+
+Workers are opt-in: in the default local mode the web process runs orders
+itself, so the worker refuses to start. Uncomment the worker line in the
+Procfile only together with ORDER_DISPATCH=fleet.
+"""
+import os
+import socket
+import sys
+import signal
+import asyncio
+import logging
+from typing import Dict, List
+from bot import FreeFireTopUpBot, INTERRUPTED_AFTER_CONFIRM
+from shared_queue import SharedQueue
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerBot(FreeFireTopUpBot):
+    """The bot's automation stack, recording CONFIRM in the shared queue instead of the local journal"""
+
+    def __init__(self, queue: SharedQueue):
+        # Runs its orders itself; the shared queue is the one FleetWorker passes in
+        super().__init__(dispatch='local')
+        self.queue = queue
+        # Serial -> shared queue id of the orders this process is running
+        self.order_ids: Dict[str, int] = {}
+
+    def confirm_hooks(self, serial: str) -> dict:
+        # Durable before the click, so a reaper never hands this order to another worker;
+        # the engines await the write, which runs off the event loop like every other queue call
+        return {'before_confirm': lambda: asyncio.to_thread(self.queue.mark_past_confirm, self.order_ids[serial])}
+
+    def not_sent_hook(self, serial: str):
+        return lambda: asyncio.to_thread(self.queue.clear_past_confirm, self.order_ids[serial])
+
+
+class FleetWorker:
+    """
+    Pulls orders from the shared queue and runs them in `slots` (WORKER_SLOTS) at a time.
+
+    Heartbeats every `heartbeat_interval` seconds (WORKER_HEARTBEAT_INTERVAL)
+    and reaps dead workers' orders on the same schedule. On shutdown,
+    unfinished orders that never reached CONFIRM go back to the queue.
+    """
+
+    def __init__(self, queue: SharedQueue = None, slots: int = None, heartbeat_interval: float = None,
+                 poll_interval: float = None):
+        self.queue = queue or SharedQueue()
+        self.slots = int(slots if slots is not None else os.environ.get('WORKER_SLOTS', 2))
+        self.heartbeat_interval = float(
+            heartbeat_interval if heartbeat_interval is not None else os.environ.get('WORKER_HEARTBEAT_INTERVAL', 5)
+        )
+        self.poll_interval = float(poll_interval if poll_interval is not None else os.environ.get('WORKER_POLL_INTERVAL', 0.5))
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.bot = WorkerBot(self.queue)
+        self.running = 0
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    async def run(self):
+        """Start the automation stack and work until stopped"""
+        await self.bot.browser_pool.start()
+        await self.bot.uid_sessions.start()
+        await self.bot.denomination_catalog.start()
+        await asyncio.to_thread(self.queue.heartbeat, self.worker_id, self.slots, 0)
+        logger.info(f"Worker {self.worker_id} started with {self.slots} slots")
+
+        self._tasks = [asyncio.create_task(self._heartbeat(), name='heartbeat')]
+        self._tasks += [asyncio.create_task(self._slot(index), name=f"slot-{index}") for index in range(self.slots)]
+        try:
+            await self._stopping.wait()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await asyncio.to_thread(self.queue.unregister, self.worker_id)
+            await self.bot.uid_sessions.stop()
+            await self.bot.browser_pool.stop()
+            await self.bot.denomination_catalog.stop()
+            await self.bot.http_engine.stop()
+            self.bot.selector_scoreboard.flush()
+            logger.info(f"Worker {self.worker_id} stopped")
+
+    def stop(self):
+        self._stopping.set()
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.queue.heartbeat, self.worker_id, self.slots, self.running)
+                await asyncio.to_thread(self.queue.reap, INTERRUPTED_AFTER_CONFIRM)
+            except Exception as e:
+                logger.error(f"Heartbeat failed: {e}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _slot(self, index: int):
+        while True:
+            order = await asyncio.to_thread(self.queue.claim, self.worker_id)
+            if order is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            logger.info(f"Slot {index} running order {order['serial']} (attempt {order['attempts'] + 1})")
+            self.running += 1
+            self.bot.order_ids[order['serial']] = order['id']
+            try:
+                result = await self.bot.process_top_up(
+                    order['uid'], order['amount'], order['serial'], order['pin'], engine=order['engine']
+                )
+            except asyncio.CancelledError:
+                await asyncio.to_thread(self.queue.release, order['id'])
+                raise
+            except Exception as e:
+                logger.error(f"Slot {index} failed order {order['serial']}: {e}")
+                result = f"❌ *Top-up process failed:* `{str(e)}`"
+            finally:
+                self.running -= 1
+                self.bot.order_ids.pop(order['serial'], None)
+            await asyncio.to_thread(self.queue.finish, order['id'], result)
+
+
+async def main():
+    if os.environ.get('ORDER_DISPATCH', 'local') != 'fleet':
+        logger.error("worker.py only runs in fleet mode: set ORDER_DISPATCH=fleet here and on the web process")
+        sys.exit(2)
+    worker = FleetWorker()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+    await worker.run()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())